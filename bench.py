@@ -0,0 +1,317 @@
+#
+# Benchmarks for the solar and battery model
+#
+# Runs offline on generated Octopus style data, e.g:
+#   python3 bench.py                         run everything
+#   python3 bench.py ingest batch --years 3  run some benchmarks
+#   python3 bench.py --save baseline.json    save results to compare against later
+#   python3 bench.py --compare baseline.json report changes and fail on regressions
+#
+from datetime import datetime
+from datetime import timedelta
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import os
+import tempfile
+import numpy as np
+import solar
+
+def last_sunday(year, month):
+    day = datetime(year, month, 31 if month in (3, 10) else 30, 1)
+    while day.weekday() != 6:
+        day -= timedelta(days=1)
+    return day
+
+def make_csv(filename, years=3, seed=1):
+    """
+    Write a half hourly Octopus style consumption CSV ending at the start of this year
+    Times are local, in BST (+01:00) between the last Sunday of March and October at 01:00 UTC and otherwise Z
+    """
+    rand = random.Random(seed)
+    end_year = datetime.now().year
+    utc = datetime(end_year - years, 1, 1)
+    end = datetime(end_year, 1, 1)
+    rows = 0
+    with open(filename, 'w') as han:
+        han.write("Consumption (kWh), Start, End\n")
+        while utc < end:
+            bst = last_sunday(utc.year, 3) <= utc < last_sunday(utc.year, 10)
+            start = utc + timedelta(hours=1) if bst else utc
+            finish = start + timedelta(minutes=30)
+            offset = "+01:00" if bst else "Z"
+            usage = 0.05 + rand.random() * 0.4 + (0.5 if 17 <= start.hour < 21 else 0.0)
+            han.write("%0.3f, %s%s, %s%s\n" % (usage, start.strftime('%Y-%m-%dT%H:%M:%S'), offset, finish.strftime('%Y-%m-%dT%H:%M:%S'), offset))
+            utc += timedelta(minutes=30)
+            rows += 1
+    return rows
+
+# Trace peak memory with an extra run of each benchmark
+MEMORY = True
+
+def measure(func, repeat=1):
+    """
+    Best wall time of repeat calls, then the peak memory of one more call traced with tracemalloc (which slows it down)
+    Returns (seconds, peak bytes, result)
+    """
+    best = None
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = 0
+    if MEMORY:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak, result
+
+def empty_load():
+    load = solar.cl_load(None, False, profile=solar.CONFIG['PROFILE'], total=solar.CONFIG['ANNUAL_USAGE'])
+    load.clear()
+    return load
+
+def profile_load():
+    return solar.cl_load(None, False, profile=solar.CONFIG['PROFILE'], total=solar.CONFIG['ANNUAL_USAGE'])
+
+def size_grid(size):
+    """
+    Scenario configs for a size x size grid of battery and solar sizes
+    """
+    configs = []
+    for battery in np.linspace(0, 18, size):
+        for panels in np.linspace(0, 8, size):
+            configs.append(dict(solar.CONFIG, BATTERY_SIZE=float(battery), SOLAR_SIZE=float(panels)))
+    return configs
+
+def bench_ingest(context):
+    """
+    Streaming CSV parser against parsing via load_csv() and process_results()
+    """
+    filename, rows = context['csv'], context['rows']
+    def legacy_ingest():
+        load = empty_load()
+        load.process_results(load.load_csv(filename))
+        return load
+
+    def stream_ingest():
+        load = empty_load()
+        load.accumulate(load.read_csv(filename))
+        return load
+
+    legacy_time, legacy_peak, legacy = measure(legacy_ingest)
+    stream_time, stream_peak, stream = measure(stream_ingest)
+    if not (np.array_equal(legacy.energy, stream.energy) and np.array_equal(legacy.present, stream.present)):
+        raise ValueError("streaming parser results differ from process_results")
+    return {
+        'ingest_legacy' : {'seconds' : legacy_time, 'rows_per_second' : rows / legacy_time, 'peak_bytes' : legacy_peak},
+        'ingest_stream' : {'seconds' : stream_time, 'rows_per_second' : rows / stream_time, 'peak_bytes' : stream_peak}
+    }
+
+def bench_sun(context):
+    """
+    Building the sun table from the sunrise file and the memoized lookup
+    """
+    sunrise = solar.CONFIG['SUNRISE']
+    build_time, build_peak, _ = measure(lambda: solar.build_sun_table(sunrise, solar.SUN_HOURS_PER_DAY), repeat=3)
+    cached_time, cached_peak, _ = measure(lambda: solar.cl_sun(sunrise), repeat=3)
+    return {
+        'sun_build' : {'seconds' : build_time, 'peak_bytes' : build_peak},
+        'sun_cached' : {'seconds' : cached_time, 'peak_bytes' : cached_peak}
+    }
+
+def bench_scenario(context):
+    """
+    One scenario through the pure Python hourly loop
+    """
+    load = context['load']
+    seconds, peak, _ = measure(lambda: solar.run_scenario(False, False, load), repeat=3)
+    return {'run_scenario' : {'seconds' : seconds, 'scenarios_per_second' : 1 / seconds, 'hours_per_second' : 365 * 24 / seconds, 'peak_bytes' : peak}}
+
+def bench_batch(context):
+    """
+    A large grid of battery and solar sizes through the batch engine
+    """
+    load = context['load']
+    configs = size_grid(context['grid'])
+    seconds, peak, _ = measure(lambda: solar.run_scenarios(configs, load))
+    return {'batch' : {'seconds' : seconds, 'scenarios' : len(configs), 'scenarios_per_second' : len(configs) / seconds,
+                       'hours_per_second' : len(configs) * 365 * 24 / seconds, 'peak_bytes' : peak}}
+
+def bench_simulate(context):
+    """
+    Full projection over the configured years from generated CSV data and from the profile
+    """
+    results = {}
+    for mode in ['csv', 'profile']:
+        seconds, peak, _ = measure(lambda: solar.project(solar.load_data(mode, show=False), show=False))
+        results['simulate_' + mode] = {'seconds' : seconds, 'years' : solar.CONFIG['YEARS'], 'peak_bytes' : peak}
+    return results
+
+def bench_kernel(context):
+    """
+    One scenario through the compiled kernel, checking its costs match run_scenario across a mix of configs
+    The parity run compiles the kernel before it is timed, without numba the uncompiled kernel is timed
+    """
+    load = context['load']
+    sun = solar.cl_sun(solar.CONFIG['SUNRISE']).table()
+    configs = []
+    for dynamic in [0, 2]:
+        for night in [True, False]:
+            configs += [dict(config, DYNAMIC_CHARGE=dynamic, BATTERY_CHARGE_NIGHT=night) for config in size_grid(3)]
+
+    expected = [solar.run_scenario(False, False, load, config) for config in configs]
+    kernel = solar.cl_kernel(configs)
+    costs = kernel.run(load.table(), sun)
+    mismatches = sum(1 for cost, check in zip(costs.tolist(), expected) if cost != check)
+    if mismatches:
+        print("ERROR: kernel costs differ from run_scenario in %d of %d scenarios" % (mismatches, len(configs)))
+
+    kernel = solar.cl_kernel([dict(solar.CONFIG)])
+    seconds, peak, _ = measure(lambda: kernel.run(load.table(), sun), repeat=20 if solar.numba else 3)
+    return {'kernel' : {'seconds' : seconds, 'scenarios_per_second' : 1 / seconds, 'hours_per_second' : 365 * 24 / seconds,
+                        'compiled' : int(bool(solar.numba)), 'mismatches' : mismatches, 'peak_bytes' : peak}}
+
+def bench_slots(context):
+    """
+    A year of half hour slots through the engine for one scenario against a year of hours through the pure Python loop
+    Without numba the uncompiled kernel is timed
+    """
+    config = dict(solar.CONFIG, SLOT_MINUTES=30, PROFILE_BACKFILL=True)
+    hourly = solar.cl_load(context['csv'], False, config=dict(config, SLOT_MINUTES=60))
+    half_hour = solar.cl_load(context['csv'], False, config=config)
+    sun = solar.cl_sun(config['SUNRISE'], slot_minutes=30).table()
+    engine = getattr(solar, solar.scenario_engine(config))([config])
+    engine.run(half_hour.table(), sun)
+
+    loop_time, _, _ = measure(lambda: solar.run_scenario(False, False, hourly), repeat=3)
+    seconds, peak, _ = measure(lambda: engine.run(half_hour.table(), sun), repeat=20 if solar.numba else 3)
+    slots = 365 * solar.day_slots(config)
+    return {'slots' : {'seconds' : seconds, 'slots_per_second' : slots / seconds, 'loop_seconds' : loop_time,
+                       'speedup' : loop_time / seconds, 'compiled' : int(bool(solar.numba)), 'peak_bytes' : peak}}
+
+def bench_dispatch(context):
+    """
+    Optimal dispatch over a mix of configs, checking it never costs more than the heuristic in run_scenario
+    """
+    load = context['load']
+    sun = solar.cl_sun(solar.CONFIG['SUNRISE']).table()
+    configs = []
+    for night in [True, False]:
+        configs += [dict(config, BATTERY_CHARGE_NIGHT=night, DISPATCH='optimal') for config in size_grid(3)]
+
+    expected = [solar.run_scenario(False, False, load, config) for config in configs]
+    dispatch = solar.cl_dispatch(configs)
+    seconds, peak, costs = measure(lambda: dispatch.run(load.table(), sun))
+    mismatches = sum(1 for cost, check in zip(costs.tolist(), expected) if cost > check + 1e-6)
+    if mismatches:
+        print("ERROR: optimal dispatch costs more than the heuristic in %d of %d scenarios" % (mismatches, len(configs)))
+    return {'dispatch' : {'seconds' : seconds, 'scenarios' : len(configs), 'scenarios_per_second' : len(configs) / seconds,
+                          'mismatches' : mismatches, 'peak_bytes' : peak}}
+
+def bench_ensemble(context):
+    """
+    A weather ensemble over the configured years in one process, smaller without numba
+    """
+    members = 1000 if solar.numba else 100
+    output = os.path.join(os.path.dirname(solar.CONFIG['CONSUMPTION']), 'ensemble.csv')
+    seconds, peak, _ = measure(lambda: solar.ensemble(context['load'], members, output, workers=1))
+    return {'ensemble' : {'seconds' : seconds, 'members' : members, 'years' : solar.CONFIG['YEARS'],
+                          'scenarios_per_second' : members * solar.CONFIG['YEARS'] / seconds, 'peak_bytes' : peak}}
+
+BENCHMARKS = {
+    'ingest' : bench_ingest,
+    'sun' : bench_sun,
+    'scenario' : bench_scenario,
+    'kernel' : bench_kernel,
+    'batch' : bench_batch,
+    'simulate' : bench_simulate,
+    'slots' : bench_slots,
+    'dispatch' : bench_dispatch,
+    'ensemble' : bench_ensemble
+}
+
+# Metrics where bigger is better, everything else is smaller is better
+FASTER = ['rows_per_second', 'scenarios_per_second', 'hours_per_second', 'slots_per_second']
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change against a saved baseline, returns the number of regressions beyond the tolerance
+    """
+    regressions = 0
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not old or not value or metric not in FASTER + ['seconds', 'peak_bytes']:
+                continue
+            ratio = value / old if metric in FASTER else old / value
+            flag = ''
+            if ratio < 1.0 - tolerance:
+                flag = ' REGRESSION'
+                regressions += 1
+            print("    %-16s %-22s %14.4g -> %14.4g (%0.2fx)%s" % (name, metric, old, value, ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Solar and battery simulator benchmarks')
+    parser.add_argument('bench', nargs='*', help='Benchmarks to run from %s (default all)' % ", ".join(BENCHMARKS))
+    parser.add_argument('--years', type=int, default=3, help='Years of generated consumption data')
+    parser.add_argument('--grid', type=int, default=20, help='Battery and solar sizes in each direction for the batch benchmark')
+    parser.add_argument('--save', help='Save the results as a baseline JSON file')
+    parser.add_argument('--compare', help='Compare against a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Fractional slow down reported as a regression')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the extra traced run used to measure peak memory')
+    args = parser.parse_args()
+
+    global MEMORY
+    MEMORY = not args.no_memory
+
+    names = args.bench or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print("ERROR: Unknown benchmark %s" % name)
+            return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Generated data only, no snapshots or traces
+        solar.CONFIG['CONSUMPTION'] = os.path.join(tmp, 'consumption.csv')
+        solar.CONFIG['SUNRISE'] = os.path.join(os.path.dirname(os.path.abspath(solar.__file__)), 'sunrise.txt')
+        solar.CONFIG['LOAD_CACHE'] = ''
+        solar.CONFIG['BATTERY_SIZE'] = 4.8
+        solar.CONFIG['SOLAR_SIZE'] = 3
+        context = {
+            'csv' : solar.CONFIG['CONSUMPTION'],
+            'rows' : make_csv(solar.CONFIG['CONSUMPTION'], args.years),
+            'load' : profile_load(),
+            'grid' : args.grid
+        }
+
+        results = {}
+        for name in names:
+            for result, metrics in BENCHMARKS[name](context).items():
+                results[result] = metrics
+                print("%-16s %s" % (result, "  ".join("%s %0.4g" % (metric, value) for metric, value in metrics.items())))
+
+    if any(metrics.get('mismatches') for metrics in results.values()):
+        return 1
+
+    if args.save:
+        with open(args.save, 'w') as han:
+            json.dump(results, han, indent=2)
+        print("Saved results to %s" % args.save)
+
+    if args.compare:
+        with open(args.compare, 'r') as han:
+            baseline = json.load(han)
+        print("Compared to %s:" % args.compare)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
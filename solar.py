@@ -1,596 +1,3072 @@
-#
-# Solar and battery model based on the use of Octopus Energy consumption data
-#
-# Copyright Trefor Southwell - 2022 - trefor@tdlj.net
-#
-# No warranty is given for the accuracy of predictions made by this model or the real savings that can be achieved
-#
-from datetime import datetime
-from datetime import timedelta
-import math
-import yaml
-import argparse
-import sys
-import urllib.request
-import json
-import re
-
-# Default configuration - overriden by YML
-CONFIG = {
-    'NIGHT_START' : 1,
-    'NIGHT_END' : 5,
-    'BATTERY_SIZE' : 0,
-    'BATTERY_LOSS' : 0.96,
-    'BATTERY_DOD'  : 0.90,
-    'BATTERY_PEAK_DRAW' : 3.0,
-    'BATTERY_MAX_CHARGE_RATE' : 3.0,
-    'BATTERY_CHARGE_NIGHT' : True,
-    'BATTERY_GROW' : 0,
-    'BATTERY_GROW_COST' : 1000,
-    'BATTERY_MAX' : 18,
-    'SOLAR_SIZE' : 0,
-    'SOLAR_YIELD' : 1.0,
-    'PRICE_DAY' : 0.30,
-    'PRICE_NIGHT' : 0.075,
-    'PRICE_FEEDIN' : 0.04,
-    'PRICE_NIGHT_TRACKS' : False,
-    'DYNAMIC_CHARGE' : 0,
-    'ANNUAL_BATTERY_LOSS' : 0.984,
-    'INFLATION' : 1.03,
-    'EQUIPMENT_COST' : 0,
-    'YEARS' : 15,
-    'PROFILE' : [1,1,1,1,1,1,2,5,5,5,4,4,7,5,3,2,3,4,5,5,4,4,4,2],
-    'PROFILE_BACKFILL' : False,
-    'CONSUMPTION' : "consumption.csv",
-    'ANNUAL_USAGE': 6000.0,
-    'SUNRISE': "sunrise.txt",
-    'API_KEY' : None,
-    'API_MPAN' : None,
-    'API_SERIAL' : None,
-    'API_CONSUMPTION' : "https://api.octopus.energy/v1/electricity-meter-points/%s/meters/%s/consumption/?page_size=20000",
-    'API_ACCOUNT' : "https://api.octopus.energy/v1/accounts/%s/"
-}
-
-def is_night_rate(hour):
-    nstart = CONFIG['NIGHT_START']
-    nend = CONFIG['NIGHT_END']
-    if nstart <= nend:
-        if hour >= nstart and hour < nend:
-            return True
-        else:
-            return False
-    else:
-        if hour >= nstart or hour < nend:
-            return True
-        else:
-            return False
-
-class cl_logger:
-    def __init__(self, filename, filename_day):
-        self.cost_prev = 0
-        self.han = open(filename, 'w')
-        self.hand = open(filename_day, 'w')
-        self.han.write("mode, day, hour, load, solar_produce, charge_battery, draw_grid, battery_level, target_charge_level, battery_undersize, cost\n")
-        self.hand.write("day, day_kwh, night_kwh, cost_day, cost_night\n")
-        self.reset_day()
-
-    def reset_day(self):
-        self.day_kwh = 0
-        self.day_cost = 0
-        self.night_kwh = 0
-        self.night_cost = 0
-
-    def row(self, mode, day, hour, load, produce, charge, grid, battery, target_charge_level, battery_undersize, cost):
-        self.han.write("%s, %d, %d, %f, %f, %f, %f, %f, %f, %f, %0.2f\n" % (mode, day, hour, load, produce, charge, grid, battery, target_charge_level, battery_undersize, cost))
-
-        if (hour == 0):
-            self.reset_day()
-
-        if (mode == "Night"):
-            self.night_cost += cost - self.cost_prev
-            self.night_kwh += grid
-        else:
-            self.day_kwh += grid
-            self.day_cost += cost - self.cost_prev
-
-        if (hour == 23):
-            self.row_day(day, self.day_kwh, self.night_kwh, self.day_cost, self.night_cost)
-
-        # Grid cost is total for the year 
-        self.cost_prev = cost
-
-    def row_day(self, day, daykw, nightkw, cost_day, cost_night):
-        self.hand.write(("%d, %f, %f, %f, %f\n") % (day, daykw, nightkw, cost_day, cost_night))
-
-class cl_battery:
-    """ Battery model """
-    def __init__(self, cap, loss, dod):
-        self.charge = 0
-        self.max = cap * dod
-        self.loss = loss
-        self.charge_in = 0
-        self.charge_out = 0
-        self.target_charge_level = self.max
-        self.undersize = 0
-        self.last_undersize = 0
-    
-    def hour(self, hour):
-        # store last nights charge level
-        if (hour == 0):
-           self.last_charge_level = self.charge
-           self.last_undersize = self.undersize
-           self.undersize = 0
-
-           if CONFIG['DYNAMIC_CHARGE']:
-               if (self.last_undersize > 0.0):
-                   self.target_charge_level = max(max(0, self.target_charge_level + self.last_undersize), CONFIG['DYNAMIC_CHARGE'])
-               elif (self.last_charge_level > 1.0):
-                   self.target_charge_level = max(min(self.max, self.target_charge_level - self.last_charge_level + 1.0), CONFIG['DYNAMIC_CHARGE'])
-
-               # Can not target charge higher than the battery size
-               self.target_charge_level = min(self.target_charge_level, self.max)
-
-    def do_charge(self, kw):
-
-        charge_amount = kw * self.loss
-        if charge_amount + self.charge > self.max:
-            charge_amount = self.max - self.charge
-
-        # Left over energy doesn't have losses in battery
-        kw = kw - (charge_amount / self.loss)
-            
-        self.charge    += charge_amount
-        self.charge_in += charge_amount
-
-        return kw
-
-    def draw(self, kw):
-        # print "battery draw from %f %f" % (self.charge, kw)
-        drawn = min(self.charge, kw)
-        drawn = min(drawn, CONFIG['BATTERY_PEAK_DRAW'])
-        self.charge -= drawn
-        self.charge_out += drawn
-        return kw - drawn
-
-    def track_undersize(self, kw, hour):
-        # track if battery was undersized/undercharged (we used the grid instead)
-        self.undersize += kw
-
-    def can_charge(self):
-        # Base on yesterdays performance lets give some margin but try to target zero battery at midnight
-        recommended = max(self.target_charge_level - self.charge, 0)
-        return recommended / self.loss
-
-    def show(self):
-        print ("Battery is at %f kw / %f max" % (self.charge, self.max))
-        print ("Battery incoming energy %f kw outgoing %f kw" % (self.charge_in, self.charge_out))
-
-class cl_panels:
-    """ Solar panel model """
-    def __init__(self, size, efficiency):
-        self.size = size
-        self.producing = 0
-        self.total_produced = 0
-        self.efficiency = efficiency
-        
-    def energy(self, hours):
-        energy = self.size * hours * self.efficiency
-        self.total_produced += energy
-        self.producing = energy
-        return energy
-    
-    def show(self):
-        print ("Panel size %f produced %f kw\n" % (self.size, self.total_produced))
-        
-class cl_sun:
-    """ Sun model """
-    def hours(self, day, hour):
-        rise = self.rise[day]
-        fall = self.fall[day]
-        hours_per_day = self.sun_hours_per_day[rise.month - 1]
-
-        if hour < rise.hour:
-            return 0
-        if hour >= fall.hour:
-            return 0
-
-        # seconds = (fall - rise).total_seconds()
-        hours = fall.hour - rise.hour + 1 # seconds / (60.0 * 60.0)
-        hour_offset = hour - rise.hour + 0.5
-
-        # place in curve
-        place = math.sin(3.141 * hour_offset / hours) * 1.5
-
-        hours_per_hour = hours_per_day / float(hours) * place
-        return hours_per_hour
-        
-    def __init__(self, sunrise):
-        self.sun_hours_per_day = [1.8, 2.7, 5.2, 7.8, 9.7, 6.2, 5.6, 5.2, 5.4, 2.2, 2.1, 1.6]
-        self.rise = {}
-        self.fall = {}
-        with open(sunrise, 'r') as han:
-            day = 1
-            for line in han:
-                if line:
-                    rise, set = line.split()
-                    rise_t = datetime.strptime(rise, '%H:%M:%S')
-                    fall_t = datetime.strptime(set, '%H:%M:%S')
-                    rise_t += timedelta(days=day)
-                    fall_t += timedelta(days=day)
-                    self.rise[day] = rise_t
-                    self.fall[day] = fall_t
-                    day += 1
-
-class cl_grid:
-    """ Grid model """
-    def __init__(self):
-        self.total_drawn = 0
-        self.draw_day = 0
-        self.draw_night = 0
-        self.draw_feedin = 0
-        self.cost = 0
-        self.cost_day = 0
-        self.cost_night = 0
-        self.cost_feedin = 0
-        self.price_day = CONFIG['PRICE_DAY']
-        self.price_night = CONFIG['PRICE_NIGHT']
-        self.price_feedin = CONFIG['PRICE_FEEDIN']
-
-    def draw(self, load, hour):
-        if load > 0:
-            self.total_drawn += load
-            if is_night_rate(hour):
-                self.cost += self.price_night * load
-                self.cost_night += self.price_night * load
-                self.draw_night += load
-            else:
-                self.cost_day += self.price_day * load
-                self.cost += self.price_day * load
-                self.draw_day += load
-        else:
-            self.cost += self.price_feedin * load
-            self.cost_feedin += self.price_feedin * load 
-            self.draw_feedin += load
-
-    def show(self):
-        print ("Grid has drawn %lf kw (day %lf kwh, night %lf kwh, feedin %lf kwh)" % (self.total_drawn, self.draw_day, self.draw_night, self.draw_feedin))
-        print ("Grid has cost  %lf    (day rate %lf night %lf      feedin %lf )" % (self.cost, self.cost_day, self.cost_night, self.cost_feedin))
-        
-class cl_load:
-    """ Load model """
-
-    def load(self, kw):
-        self.total_used += kw
-    
-    def create_profile(self, profile, total, create_day=None):
-        profile_sum = 0.0
-        for hour in range(24):
-            profile_sum += profile[hour]
-        for hour in range(24):
-            profile[hour] = profile[hour] / profile_sum * 100.0
-
-        for day in range(1, 365+1):
-            if (not create_day or create_day == day):
-                self.data[day] = {}
-                for hour in range(24):
-                    usage = profile[hour] * total / 100 / 365
-                    self.data[day][hour] = usage
-
-    def load_csv(self, filename):
-        results = []
-        with open(filename, 'r') as han:
-            last_hour = -1
-            for line in han:
-                if line:
-                    line = line.strip()
-                    fields = line.split(',')
-                    if not fields[0].startswith('Consumption'):
-                        point = {}
-                        point['consumption'] = float(fields[0])
-                        point['interval_start'] = fields[1]
-                        point['interval_end'] = fields[2]
-                        results.append(point)
-        return results
-
-    def process_results(self, results):
-        """
-        Change octoput results into data points
-        """
-        for result in results:
-            istart = result['interval_start']
-            iend   = result['interval_end']
-            energy = result['consumption']
-
-            start_date, start_time = istart.split('T')
-            end_date, end_time = iend.split('T')
-            start_time, offset_time = re.split('\+|Z', start_time)
-            end_time, offset_end_time = re.split('\+|Z', end_time)
-            start = datetime.strptime(start_date.strip() + " " + start_time, '%Y-%m-%d %H:%M:%S')
-            end   = datetime.strptime(end_date.strip()   + " " + end_time,   '%Y-%m-%d %H:%M:%S')
-
-            day_of_year = start.timetuple().tm_yday
-            hour_of_day_start = start.hour
-            hour_of_day_end = end.hour
-            hours = hour_of_day_end - hour_of_day_start
-            if (hours == 0):
-                hours = 1
-
-            for hour in range(hour_of_day_start, hour_of_day_start + hours):
-                if day_of_year not in self.data:
-                    self.data[day_of_year] = {}
-                if hour not in self.data[day_of_year]:
-                    self.data[day_of_year][hour] = energy / hours
-                elif last_hour == hour_of_day_start:
-                    self.data[day_of_year][hour] += energy / hours
-                else:
-                    # If the data covers multiple years use the latest only
-                    self.data[day_of_year][hour] = energy / hours
-
-                last_hour = hour_of_day_start
-    
-    def validate_data(self, show):
-        self.hourly = [0 for i in range(24)]
-
-        for day in range(1, 365 + 1):
-            for hour in range(24):
-                if day not in self.data:
-                    if CONFIG['PROFILE_BACKFILL']:
-                        print("WARN: Input data is incomplete for day %d, using profile" % day)
-                        self.create_profile(CONFIG['PROFILE', CONFIG['ANNUAL_USAGE']], create_day=day)
-                    else:
-                        print("ERROR: Input data is incomplete for day %d" % day)
-                        exit(1)
-
-                if hour not in self.data[day]:
-                    if CONFIG['PROFILE_BACKFILL']:
-                        print("WARN: Input data is incomplete for day %d hour %d, using profile for the day" % (day, hour))
-                        self.create_profile(CONFIG['PROFILE'], CONFIG['ANNUAL_USAGE'], create_day=day)
-                    else:
-                        print("ERROR: Input data is incomplete for day %d hour %d" % (day, hour))
-                        exit(1)
-
-                # Count per hour
-                self.hourly[hour] += self.data[day][hour]
-        
-        # Create hourly profile
-        self.hourly_profile = [0 for i in range(24)]
-        total = sum(self.hourly)
-        for hour in range(24):
-            self.hourly_profile[hour] = self.hourly[hour] / total
-        
-        # Show profile
-        if show:
-            print("Total annual energy use: %0.2f kWh hourly profile:  " % total)
-            print("    ", end='')
-            for hour in range(24):
-                vstr = "%0.2f, " % (self.hourly_profile[hour] * 100.0)
-                print(vstr, end="")
-            print()
-
-    def reset(self):
-        self.total_used = 0
-
-    def __init__(self, filename, show, profile=None, total=3000.0, apimode=False):
-        self.data = {}
-        self.reset()
-        
-        if apimode:
-            self.process_results(self.load_api())
-        elif filename:
-            self.process_results(self.load_csv(filename))
-        else:
-            self.create_profile(profile, total)
-        self.validate_data(show)
-        
-                            
-    def get_load(self, day, hour):
-        if day in self.data:
-            if hour in self.data[day]:
-                if self.data[day][hour]:
-                    return self.data[day][hour]
-        return 0
-
-    def show(self):
-        print ("Total energy load used %lf kWh" % self.total_used)
-
-    def set_api(self, api):
-        print ("Login to api %s" % api)
-        uname = CONFIG['API_KEY']
-        password_mgr = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        password_mgr.add_password(None, api, uname, '')
-        handler = urllib.request.HTTPBasicAuthHandler(password_mgr)
-        opener = urllib.request.build_opener(handler)
-        opener.open(api)
-        urllib.request.install_opener(opener)
-
-    def load_api(self, maxpoints=365*24*2):
-        """
-        Fetch consumption data from Octopus API
-        """
-        results = []
-
-        if (not CONFIG['API_KEY']) or (not CONFIG['API_MPAN']) or (not CONFIG['API_SERIAL']):
-            print("ERROR: You must set API_KEY, API_MPAN and API_SERIAL to load from Octopus API")
-            exit(1)
-
-        api = CONFIG['API_CONSUMPTION'] % (CONFIG['API_MPAN'], CONFIG['API_SERIAL'])
-        self.set_api(api)
-
-        while api and len(results) < maxpoints:
-            print("Fetching %s" % api)
-            with urllib.request.urlopen(api) as url:
-                tdata = url.read()
-                data = json.loads(tdata)
-                if 'results' in data:
-                    results += data['results']
-                if 'next' in data:
-                    api = data['next']
-                else:
-                    api = None
-        print("Downloaded %d data points" % len(results))
-        return results
-
-def run_scenario(show, show_base, load):
-    if show:
-        print ("---------- BATTERY %f SOLAR %f COST %0.2f--------" % (CONFIG['BATTERY_SIZE'], CONFIG['SOLAR_SIZE'], CONFIG['EQUIPMENT_COST']))
-
-    if show:
-        log = cl_logger("data_bat%f_sol%f.csv"  % (CONFIG['BATTERY_SIZE'], CONFIG['SOLAR_SIZE']), "data_bat%f_sol%f_daily.csv"  % (CONFIG['BATTERY_SIZE'], CONFIG['SOLAR_SIZE']))
-    elif show_base:
-        log = cl_logger("data_baseline.csv", "data_baseline_daily.csv")
-    else:
-        log = None
-
-    # Battery in kw and loss %
-    battery = cl_battery(CONFIG['BATTERY_SIZE'], CONFIG['BATTERY_LOSS'], CONFIG['BATTERY_DOD'])
-
-    # Panel in kw and loss %
-    panel = cl_panels(CONFIG['SOLAR_SIZE'], 0.627 * CONFIG['SOLAR_YIELD'])
-
-    # Sunrise data
-    sun = cl_sun(CONFIG['SUNRISE'])
-
-    # Reset load data
-    load.reset()
-
-    # Create grid
-    grid = cl_grid()
-
-    # One year
-    day = 1
-    while (day <= 365):
-        hour = 0
-        while (hour < 24):
-            hours = sun.hours(day, hour)
-            solar_energy = panel.energy(hours)
-            battery.hour(hour)
-        
-            use = load.get_load(day, hour)
-            load.load(use)
-        
-            spare_energy = solar_energy - use
-            if spare_energy > 0:
-              # Charge battery?
-              left_over_energy = battery.do_charge(spare_energy)
-              # Feed in?
-              if left_over_energy > 0:
-                  grid.draw(-left_over_energy, hour)        
-              if log:      
-                  log.row("Spare", day, hour, use, solar_energy, spare_energy - left_over_energy, -left_over_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
-            else:
-                # Charge battery on cheap rate?
-                if is_night_rate(hour) and CONFIG['BATTERY_CHARGE_NIGHT']:
-                    to_battery = min(battery.can_charge(), CONFIG['BATTERY_MAX_CHARGE_RATE']) # max charge rate
-                    grid.draw(to_battery - spare_energy, hour)
-                    battery.do_charge(to_battery)
-                    if log:      
-                        log.row("Night", day, hour, use, solar_energy, to_battery, to_battery - spare_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
-                else:
-                    if is_night_rate(hour):
-                        # draw from grid
-                        balance_energy = -spare_energy
-                    else:
-                        # Draw from battery
-                        balance_energy = battery.draw(-spare_energy)
-                    if balance_energy > 0:
-                        # Buy from grid?
-                        grid.draw(balance_energy, hour)
-                        battery.track_undersize(balance_energy, hour)
-                    if log:      
-                        log.row("Day", day, hour, use, solar_energy, balance_energy + spare_energy, balance_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
-                
-            hour += 1
-        day += 1
-
-    if show:
-        load.show()
-        panel.show()
-        battery.show()
-        grid.show()
-
-    return grid.cost
-
-def simulate(mode):
-    total_cost = 0
-    base_cost = 0
-    year = 0
-
-    # Octopus data or profiled load?
-    if mode.lower() == 'api':
-        load = cl_load(None, True, apimode=True)
-    elif mode.lower() == 'csv':
-        load = cl_load(CONFIG['CONSUMPTION'], True)
-    else:
-        load = cl_load(None, True, profile=CONFIG['PROFILE'], total=CONFIG['ANNUAL_USAGE'])
-
-    while year < CONFIG['YEARS']:
-        tempb = CONFIG['BATTERY_SIZE']
-        temps = CONFIG['SOLAR_SIZE']
-        CONFIG['BATTERY_SIZE'] = 0
-        CONFIG['SOLAR_SIZE'] = 0
-
-        base_cost_year = run_scenario(False, True, load=load)
-        base_cost += base_cost_year
-
-        CONFIG['BATTERY_SIZE'] = tempb
-        CONFIG['SOLAR_SIZE'] = temps
-        annual_cost = run_scenario(year==0, False, load=load)
-        total_cost += annual_cost
-        year += 1
-
-        print("Year %2d - Rates day %0.2f night %0.2f Cost: %0.2f (%0.2f total) Base cost: %0.2f (%0.2f total) Saving %0.2f (total %0.2f)" % (year, CONFIG['PRICE_DAY'], CONFIG['PRICE_NIGHT'], annual_cost, total_cost, base_cost_year, base_cost, base_cost_year - annual_cost, base_cost - total_cost - CONFIG['EQUIPMENT_COST']))
-
-        # Annual adjustments
-        CONFIG['BATTERY_SIZE'] *= CONFIG['ANNUAL_BATTERY_LOSS'] # Loss of battery capacity
-        night_diff = CONFIG['PRICE_DAY'] - CONFIG['PRICE_NIGHT']
-        CONFIG['PRICE_DAY']    *= CONFIG['INFLATION'] # Inflation for electric costs
-        if CONFIG['PRICE_NIGHT_TRACKS']:
-            CONFIG['PRICE_NIGHT'] = CONFIG['PRICE_DAY'] - night_diff
-        else:
-            CONFIG['PRICE_NIGHT']  *= CONFIG['INFLATION'] # Inflation for electric costs
-
-        # Add batteries annually
-        if (CONFIG['BATTERY_GROW'] and (CONFIG['BATTERY_SIZE'] + CONFIG['BATTERY_GROW']) <= CONFIG['BATTERY_MAX']):
-            CONFIG['BATTERY_SIZE'] += CONFIG['BATTERY_GROW']
-            CONFIG['EQUIPMENT_COST'] += CONFIG['BATTERY_GROW_COST']
-
-def main():
-
-    parser = argparse.ArgumentParser(description='Solar and battery simulator')
-    parser.add_argument('config', help='yml configuration file name')
-    parser.add_argument('mode', help='Set the data mode which can be csv|api|profile')
-    for item in CONFIG:
-        parser.add_argument('--' + item, action='store', required=False, default=None)
-    args = parser.parse_args()
-    
-    # Read config and override defaults
-    with open(args.config, 'r') as fhan:
-        yconfig = yaml.safe_load(fhan)
-        for item in yconfig:
-            if item not in CONFIG:
-                print("ERROR: Bad configuration option in YML %s does not exist" % item)
-                return(1)
-            CONFIG[item] = yconfig[item]
-
-
-    # Command line overrides
-    for item in CONFIG:
-        if item in args:
-            value = getattr(args, item)
-            if value:
-                if isinstance(CONFIG[item], bool):
-                    CONFIG[item] = bool(value)
-                elif isinstance(CONFIG[item], (int, float)):
-                    CONFIG[item] = float(value)
-                else:
-                    CONFIG[item] = value
-
-    # Show configuration
-    print(CONFIG)
-
-    # Run a simulation
-    simulate(args.mode)
-    return 0
-
-if __name__ == "__main__":
+#
+# Solar and battery model based on the use of Octopus Energy consumption data
+#
+# Copyright Trefor Southwell - 2022 - trefor@tdlj.net
+#
+# No warranty is given for the accuracy of predictions made by this model or the real savings that can be achieved
+#
+from datetime import datetime
+from datetime import timedelta
+import math
+import yaml
+import argparse
+import sys
+import os
+import urllib.parse
+import http.client
+import http.server
+import base64
+import hashlib
+import sqlite3
+import zipfile
+import functools
+import time
+import cProfile
+import threading
+import concurrent.futures
+import json
+import contextlib
+import io
+import re
+import itertools
+import multiprocessing
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Default configuration - overriden by YML
+CONFIG = {
+    'NIGHT_START' : 1,
+    'NIGHT_END' : 5,
+    'BATTERY_SIZE' : 0,
+    'BATTERY_LOSS' : 0.96,
+    'BATTERY_DOD'  : 0.90,
+    'BATTERY_PEAK_DRAW' : 3.0,
+    'BATTERY_MAX_CHARGE_RATE' : 3.0,
+    'BATTERY_CHARGE_NIGHT' : True,
+    'BATTERY_GROW' : 0,
+    'BATTERY_GROW_COST' : 1000,
+    'BATTERY_MAX' : 18,
+    'SOLAR_SIZE' : 0,
+    'SOLAR_YIELD' : 1.0,
+    'PRICE_DAY' : 0.30,
+    'PRICE_NIGHT' : 0.075,
+    'PRICE_FEEDIN' : 0.04,
+    'PRICE_NIGHT_TRACKS' : False,
+    'DYNAMIC_CHARGE' : 0,
+    'ANNUAL_BATTERY_LOSS' : 0.984,
+    'INFLATION' : 1.03,
+    'EQUIPMENT_COST' : 0,
+    'YEARS' : 15,
+    'PROFILE' : [1,1,1,1,1,1,2,5,5,5,4,4,7,5,3,2,3,4,5,5,4,4,4,2],
+    'PROFILE_BACKFILL' : False,
+    'BACKFILL_METHOD' : "profile",
+    'CONSUMPTION' : "consumption.csv",
+    'ANNUAL_USAGE': 6000.0,
+    'SUNRISE': "sunrise.txt",
+    'SLOT_MINUTES' : 60,
+    'API_KEY' : None,
+    'API_MPAN' : None,
+    'API_SERIAL' : None,
+    'API_CONSUMPTION' : "https://api.octopus.energy/v1/electricity-meter-points/%s/meters/%s/consumption/?page_size=20000",
+    'API_ACCOUNT' : "https://api.octopus.energy/v1/accounts/%s/",
+    'API_CACHE' : "octopus_cache",
+    'API_WORKERS' : 4,
+    'LOAD_CACHE' : ".solar_cache",
+    'TRACE_YEARS' : [1],
+    'TRACE_BASELINE' : True,
+    'TRACE_FORMAT' : "csv",
+    'DISPATCH' : "heuristic",
+    'DISPATCH_STEPS' : 40,
+    'TARIFF' : [],
+    'TARIFF_FILE' : None,
+    'TARIFF_SCALE' : 1.0,
+    'JIT' : True,
+    'CHECKPOINTS' : False,
+    'RESULTS_CACHE_MB' : 256,
+    'OPTIMIZE_OBJECTIVE' : "net_saving",
+    'OPTIMIZE_BATTERY' : [0, 20],
+    'OPTIMIZE_SOLAR' : [0, 10],
+    'OPTIMIZE_GROW' : [],
+    'OPTIMIZE_STEP' : 0.1,
+    'BATTERY_COST' : 400,
+    'SOLAR_COST' : 1200,
+    'DISCOUNT_RATE' : 0.05,
+    'ENSEMBLE_SEED' : 1,
+    'ENSEMBLE_VARIATION' : 0.5,
+    'ENSEMBLE_CORRELATION' : 0.6
+}
+
+# Bump when the load snapshot layout or validation changes so old snapshots are not used
+LOAD_SNAPSHOT_VERSION = 4
+
+# Bump when the engines or the flows they return change so results and checkpoints saved by older code are not used
+RESULTS_VERSION = 1
+
+def is_night_rate(hour, config=CONFIG):
+    return in_window(hour, config['NIGHT_START'], config['NIGHT_END'])
+
+def in_window(hour, nstart, nend):
+    """
+    True if hour is within the window from nstart up to nend, the window can wrap past midnight
+    """
+    if nstart <= nend:
+        if hour >= nstart and hour < nend:
+            return True
+        else:
+            return False
+    else:
+        if hour >= nstart or hour < nend:
+            return True
+        else:
+            return False
+
+# Slot lengths in minutes the model can run at
+SLOT_LENGTHS = [30, 60]
+
+def day_slots(config=CONFIG):
+    """
+    Number of SLOT_MINUTES slots in a day
+    """
+    if config['SLOT_MINUTES'] not in SLOT_LENGTHS:
+        raise DataError("SLOT_MINUTES must be one of %s" % ", ".join(str(length) for length in SLOT_LENGTHS))
+    return int(24 * 60 // config['SLOT_MINUTES'])
+
+# Hourly trace columns and the modes a trace row can be in
+TRACE_COLUMNS = ['load', 'solar_produce', 'charge_battery', 'draw_grid', 'battery_level', 'target_charge_level', 'battery_undersize', 'cost']
+TRACE_MODES = ['Spare', 'Night', 'Day']
+
+class cl_trace:
+    """ Hourly trace of one or more scenarios, kept in preallocated columns and written out in bulk """
+    def __init__(self, rows=365*24, count=1, slots=24):
+        self.rows = rows
+        self.count = count
+        self.slots = slots
+        self.mode = np.zeros((rows, count), dtype=np.int8)
+        self.columns = {}
+        for name in TRACE_COLUMNS:
+            self.columns[name] = np.zeros((rows, count))
+
+    def row(self, mode, day, hour, load, produce, charge, grid, battery, target_charge_level, battery_undersize, cost):
+        """
+        Store one slot (hour by default) of a single scenario
+        """
+        index = (day - 1) * self.slots + hour
+        self.mode[index] = TRACE_MODES.index(mode)
+        for name, value in zip(TRACE_COLUMNS, (load, produce, charge, grid, battery, target_charge_level, battery_undersize, cost)):
+            self.columns[name][index] = value
+
+    def record(self, index, mode, values, select):
+        """
+        Store one hour for the selected scenarios of a batch, values are in TRACE_COLUMNS order
+        """
+        self.mode[index] = mode[select]
+        for name, value in zip(TRACE_COLUMNS, values):
+            self.columns[name][index] = value[select]
+
+    def scenario(self, column):
+        """
+        Split out the trace of one scenario
+        """
+        trace = cl_trace(self.rows, 0, self.slots)
+        trace.count = 1
+        trace.mode = self.mode[:, column:column + 1]
+        for name in TRACE_COLUMNS:
+            trace.columns[name] = self.columns[name][:, column:column + 1]
+        return trace
+
+    def column(self, name):
+        return self.columns[name][:, 0]
+
+    def daily(self):
+        """
+        Roll up grid energy and cost per day into night rate and everything else
+        """
+        days = self.rows // self.slots
+        night = (self.mode[:, 0] == TRACE_MODES.index('Night')).reshape(days, self.slots)
+        grid = self.column('draw_grid').reshape(days, self.slots)
+        cost = np.diff(self.column('cost'), prepend=0.0).reshape(days, self.slots)
+        return {
+            'day' : np.arange(1, days + 1),
+            'day_kwh' : np.where(night, 0.0, grid).sum(axis=1),
+            'night_kwh' : np.where(night, grid, 0.0).sum(axis=1),
+            'cost_day' : np.where(night, 0.0, cost).sum(axis=1),
+            'cost_night' : np.where(night, cost, 0.0).sum(axis=1)
+        }
+
+    def save(self, filename, filename_day, format='csv'):
+        """
+        Write the hourly trace and daily rollup of a single scenario as csv or a binary npz
+        With slots shorter than an hour the hour column is the start of each slot e.g. 13.5
+        """
+        daily = self.daily()
+        index = np.arange(self.rows)
+        hour = index % self.slots
+        if self.slots != 24:
+            hour = hour * (24.0 / self.slots)
+        if format == 'npz':
+            columns = dict((name, self.column(name)) for name in TRACE_COLUMNS)
+            np.savez(os.path.splitext(filename)[0] + '.npz', mode=self.mode[:, 0], day=index // self.slots + 1, hour=hour, **columns)
+            np.savez(os.path.splitext(filename_day)[0] + '.npz', **daily)
+            return
+
+        modes = [TRACE_MODES[mode] for mode in self.mode[:, 0].tolist()]
+        rows = zip(modes, (index // self.slots + 1).tolist(), hour.tolist(), *[self.column(name).tolist() for name in TRACE_COLUMNS])
+        with open(filename, 'w') as han:
+            han.write("mode, day, hour, " + ", ".join(TRACE_COLUMNS) + "\n")
+            han.write("".join(["%s, %d, %g, %f, %f, %f, %f, %f, %f, %f, %0.2f\n" % row for row in rows]))
+        rows = zip(*[daily[name].tolist() for name in ['day', 'day_kwh', 'night_kwh', 'cost_day', 'cost_night']])
+        with open(filename_day, 'w') as han:
+            han.write("day, day_kwh, night_kwh, cost_day, cost_night\n")
+            han.write("".join(["%d, %f, %f, %f, %f\n" % row for row in rows]))
+
+class cl_battery:
+    """ Battery model """
+    def __init__(self, cap, loss, dod, config=CONFIG):
+        self.config = config
+        self.charge = 0
+        self.max = cap * dod
+        self.loss = loss
+        self.charge_in = 0
+        self.charge_out = 0
+        self.target_charge_level = self.max
+        self.undersize = 0
+        self.last_undersize = 0
+
+        # Most energy drawn in one slot
+        self.peak_draw = config['BATTERY_PEAK_DRAW'] * (24.0 / day_slots(config))
+    
+    def hour(self, hour):
+        # store last nights charge level
+        if (hour == 0):
+           self.last_charge_level = self.charge
+           self.last_undersize = self.undersize
+           self.undersize = 0
+
+           if self.config['DYNAMIC_CHARGE']:
+               if (self.last_undersize > 0.0):
+                   self.target_charge_level = max(max(0, self.target_charge_level + self.last_undersize), self.config['DYNAMIC_CHARGE'])
+               elif (self.last_charge_level > 1.0):
+                   self.target_charge_level = max(min(self.max, self.target_charge_level - self.last_charge_level + 1.0), self.config['DYNAMIC_CHARGE'])
+
+               # Can not target charge higher than the battery size
+               self.target_charge_level = min(self.target_charge_level, self.max)
+
+    def do_charge(self, kw):
+
+        charge_amount = kw * self.loss
+        if charge_amount + self.charge > self.max:
+            charge_amount = self.max - self.charge
+
+        # Left over energy doesn't have losses in battery
+        kw = kw - (charge_amount / self.loss)
+            
+        self.charge    += charge_amount
+        self.charge_in += charge_amount
+
+        return kw
+
+    def draw(self, kw):
+        # print "battery draw from %f %f" % (self.charge, kw)
+        drawn = min(self.charge, kw)
+        drawn = min(drawn, self.peak_draw)
+        self.charge -= drawn
+        self.charge_out += drawn
+        return kw - drawn
+
+    def track_undersize(self, kw, hour):
+        # track if battery was undersized/undercharged (we used the grid instead)
+        self.undersize += kw
+
+    def can_charge(self):
+        # Base on yesterdays performance lets give some margin but try to target zero battery at midnight
+        recommended = max(self.target_charge_level - self.charge, 0)
+        return recommended / self.loss
+
+    def show(self):
+        print ("Battery is at %f kw / %f max" % (self.charge, self.max))
+        print ("Battery incoming energy %f kw outgoing %f kw" % (self.charge_in, self.charge_out))
+
+class cl_panels:
+    """ Solar panel model """
+    def __init__(self, size, efficiency):
+        self.size = size
+        self.producing = 0
+        self.total_produced = 0
+        self.efficiency = efficiency
+        
+    def energy(self, hours):
+        energy = self.size * hours * self.efficiency
+        self.total_produced += energy
+        self.producing = energy
+        return energy
+    
+    def show(self):
+        print ("Panel size %f produced %f kw\n" % (self.size, self.total_produced))
+        
+# Average sun hours per day for each month
+SUN_HOURS_PER_DAY = [1.8, 2.7, 5.2, 7.8, 9.7, 6.2, 5.6, 5.2, 5.4, 2.2, 2.1, 1.6]
+
+# Sun tables already computed, keyed by sunrise file path, modification time and sun hours per month
+SUN_CACHE = {}
+
+def build_sun_table(sunrise, sun_hours_per_day, slot_minutes=60):
+    """
+    Compute sun hours for the whole year as a 365 x slots array (row 0 is day 1) from sunrise/sunset times
+    Each slot has the sun hours at its middle on the curve through the day, times the length of the slot in hours
+    """
+    slot_hours = slot_minutes / 60.0
+    per_hour = 60 // slot_minutes
+    table = np.zeros((365, 24 * per_hour))
+    with open(sunrise, 'r') as han:
+        day = 1
+        for line in han:
+            if line and day <= 365:
+                rise, fall = line.split()
+                rise_hour = int(rise.split(':')[0])
+                fall_hour = int(fall.split(':')[0])
+                month = (datetime(1900, 1, 1) + timedelta(days=day)).month
+                hours_per_day = sun_hours_per_day[month - 1]
+
+                # seconds = (fall - rise).total_seconds()
+                hours = fall_hour - rise_hour + 1 # seconds / (60.0 * 60.0)
+                for slot in range(rise_hour * per_hour, min(fall_hour, 24) * per_hour):
+                    hour_offset = (slot + 0.5) * slot_hours - rise_hour
+
+                    # place in curve
+                    place = math.sin(3.141 * hour_offset / hours) * 1.5
+                    table[day - 1][slot] = hours_per_day / float(hours) * place * slot_hours
+                day += 1
+    return table
+
+def sun_table(sunrise, sun_hours_per_day=SUN_HOURS_PER_DAY, slot_minutes=60):
+    """
+    Return the sun hours table, only computed once per sunrise file, sun hours per month and slot length
+    """
+    path = os.path.abspath(sunrise)
+    key = (path, os.path.getmtime(path), tuple(sun_hours_per_day), slot_minutes)
+    table = SUN_CACHE.get(key)
+    if table is None:
+        table = build_sun_table(path, sun_hours_per_day, slot_minutes)
+        table.flags.writeable = False
+        SUN_CACHE[key] = table
+    return table
+
+class cl_sun:
+    """ Sun model """
+    def hours(self, day, hour):
+        return self.rows[day - 1][hour]
+
+    def table(self):
+        """
+        Sun hours for the whole year as a 365 x slots array (row 0 is day 1), shared so must not be modified
+        """
+        return self.sun_table
+
+    def __init__(self, sunrise, sun_hours_per_day=SUN_HOURS_PER_DAY, slot_minutes=60):
+        self.sun_hours_per_day = sun_hours_per_day
+        self.sun_table = sun_table(sunrise, sun_hours_per_day, int(slot_minutes))
+        self.rows = self.sun_table.tolist()
+
+class cl_grid:
+    """ Grid model """
+    def __init__(self, config=CONFIG):
+        self.config = config
+        self.total_drawn = 0
+        self.draw_day = 0
+        self.draw_night = 0
+        self.draw_feedin = 0
+        self.cost = 0
+        self.cost_day = 0
+        self.cost_night = 0
+        self.cost_feedin = 0
+        self.price_day = config['PRICE_DAY']
+        self.price_night = config['PRICE_NIGHT']
+        self.price_feedin = config['PRICE_FEEDIN']
+
+    def draw(self, load, hour):
+        if load > 0:
+            self.total_drawn += load
+            if is_night_rate(hour, self.config):
+                self.cost += self.price_night * load
+                self.cost_night += self.price_night * load
+                self.draw_night += load
+            else:
+                self.cost_day += self.price_day * load
+                self.cost += self.price_day * load
+                self.draw_day += load
+        else:
+            self.cost += self.price_feedin * load
+            self.cost_feedin += self.price_feedin * load 
+            self.draw_feedin += load
+
+    def show(self):
+        print ("Grid has drawn %lf kw (day %lf kwh, night %lf kwh, feedin %lf kwh)" % (self.total_drawn, self.draw_day, self.draw_night, self.draw_feedin))
+        print ("Grid has cost  %lf    (day rate %lf night %lf      feedin %lf )" % (self.cost, self.cost_day, self.cost_night, self.cost_feedin))
+        
+# Per-day price files by (path, modification time)
+TARIFF_FILE_CACHE = {}
+
+def tariff_file(filename, slots=24):
+    """
+    Read a per-day price file such as Agile prices, returns 365 x slots arrays of import and export prices (NaN where not given)
+    Each line is a date (YYYY-MM-DD) or day of the year then its prices. A header line before the prices names their
+    columns, the ones starting with e are export prices and the rest import prices, 24 hourly or 48 half hourly of each.
+    Without a header every line has 24 hourly import prices. Hourly prices apply to both halves of a half hour slot
+    and half hourly prices are averaged for hourly slots
+    """
+    path = os.path.abspath(filename)
+    if not os.path.exists(path):
+        raise DataError("Tariff file %s not found" % filename)
+    key = (path, os.path.getmtime(path), slots)
+    if key not in TARIFF_FILE_CACHE:
+        prices = np.full((365, slots), np.nan)
+        export = np.full((365, slots), np.nan)
+
+        def day_prices(values):
+            values = np.array(values)
+            if len(values) < slots:
+                return np.repeat(values, slots // len(values))
+            return values.reshape(slots, -1).mean(axis=1)
+
+        # Price columns of the import and export prices, hourly import prices without a header
+        columns = (list(range(24)), [])
+        header = False
+        dated = False
+        with open(path) as han:
+            for number, line in enumerate(han, 1):
+                fields = [field.strip() for field in line.split(',')]
+                if not line.strip():
+                    continue
+                if not re.match(r'\d{4}-\d{2}-\d{2}$|\d+$', fields[0]):
+                    if dated or header:
+                        raise DataError("Tariff file %s line %d is not a date or day of the year with prices" % (filename, number))
+                    header = True
+                    names = fields[1:]
+                    columns = ([index for index, name in enumerate(names) if not name.lower().startswith('e')],
+                               [index for index, name in enumerate(names) if name.lower().startswith('e')])
+                    if len(columns[0]) not in (24, 48) or len(columns[1]) not in (0, len(columns[0])):
+                        raise DataError("Tariff file %s header must name 24 or 48 import price columns and optionally as many export "
+                                        "price columns starting with e, found %d import and %d export" % (filename, len(columns[0]), len(columns[1])))
+                    continue
+                dated = True
+                try:
+                    if '-' in fields[0]:
+                        day = datetime.strptime(fields[0], '%Y-%m-%d').timetuple().tm_yday
+                    else:
+                        day = int(fields[0])
+                    values = [float(value) for value in fields[1:]]
+                except ValueError:
+                    raise DataError("Tariff file %s line %d has a bad date or price: %s" % (filename, number, line.strip()))
+                if len(values) != len(columns[0]) + len(columns[1]):
+                    raise DataError("Tariff file %s line %d has %d prices, expected %s" % (filename, number, len(values),
+                                    "the %d the header names" % (len(columns[0]) + len(columns[1])) if header else "24 hourly import prices without a header"))
+                if day < 1:
+                    raise DataError("Tariff file %s line %d has day %d, days of the year start at 1" % (filename, number, day))
+                if day > 365:
+                    continue
+                prices[day - 1] = day_prices([values[index] for index in columns[0]])
+                if columns[1]:
+                    export[day - 1] = day_prices([values[index] for index in columns[1]])
+        prices.flags.writeable = False
+        export.flags.writeable = False
+        TARIFF_FILE_CACHE[key] = (prices, export)
+    return TARIFF_FILE_CACHE[key]
+
+class cl_tariff:
+    """ Tariff compiled to import and export prices for every slot of the year """
+    def __init__(self, config=CONFIG):
+        """
+        Each slot of the year belongs to an import band and an export band with a single price, energy totalled per band
+        is priced with a dot product. The cheap slots are when the battery charges from the grid and holds its charge
+        Band and night rate windows are in hours, a slot is in a window when its start is e.g. 0.5 for 00:30
+        - Two rate (default) - PRICE_DAY with PRICE_NIGHT from NIGHT_START to NIGHT_END, the night hours are cheap
+        - TARIFF - a list of bands e.g. {start: 16, end: 19, price: 0.42}, later bands take priority and hours outside
+          every band are at PRICE_DAY. Bands with charge: True are cheap, otherwise the lowest priced hours are
+        - TARIFF_FILE - per-day prices (see tariff_file) replace the above on the days given, the cheapest slots of
+          each day are cheap, as many of them as the tariff above has on that day
+        TARIFF and TARIFF_FILE import prices are multiplied by TARIFF_SCALE, which grows with inflation each year
+        """
+        scale = config['TARIFF_SCALE']
+        slots = day_slots(config)
+        starts = [slot * 24.0 / slots for slot in range(slots)]
+        export_prices = [config['PRICE_FEEDIN']]
+        if config['TARIFF']:
+            bands = config['TARIFF']
+            prices = [band['price'] * scale for band in bands] + [config['PRICE_DAY']]
+            hour_band = [len(bands)] * slots
+            for index, band in enumerate(bands):
+                for slot, start in enumerate(starts):
+                    if in_window(start, band['start'], band['end']):
+                        hour_band[slot] = index
+            if any('charge' in band for band in bands):
+                cheap = [bool(band.get('charge', False)) for band in bands] + [False]
+            else:
+                lowest = min(prices[band] for band in hour_band)
+                cheap = [price == lowest for price in prices]
+        else:
+            prices = [config['PRICE_DAY'], config['PRICE_NIGHT']]
+            hour_band = [int(is_night_rate(start, config)) for start in starts]
+            cheap = [False, True]
+
+        self.import_band = np.tile(np.array(hour_band), (365, 1))
+        self.export_band = np.zeros((365, slots), dtype=int)
+        self.cheap = np.tile(np.array(cheap)[hour_band], (365, 1))
+        self.import_prices = np.array(prices, dtype=float)
+        self.export_prices = np.array(export_prices, dtype=float)
+        self.import_cheap = np.array(cheap, dtype=bool)
+
+        if config['TARIFF_FILE']:
+            file_prices, file_export = tariff_file(config['TARIFF_FILE'], slots)
+            year = np.arange(365 * slots).reshape(365, slots)
+
+            # Every slot of the file gets its own band after the bands above
+            days = ~np.isnan(file_prices).any(axis=1)
+            rank = file_prices.argsort(axis=1).argsort(axis=1)
+            cheap = rank < self.cheap.sum(axis=1)[:, None]
+            self.cheap = np.where(days[:, None], cheap, self.cheap)
+            self.import_band = np.where(days[:, None], len(prices) + year, self.import_band)
+            self.import_prices = np.concatenate([self.import_prices, np.nan_to_num(file_prices.reshape(-1)) * scale])
+            self.import_cheap = np.concatenate([self.import_cheap, cheap.reshape(-1)])
+
+            days = ~np.isnan(file_export).any(axis=1)
+            if days.any():
+                self.export_band = np.where(days[:, None], len(export_prices) + year, self.export_band)
+                self.export_prices = np.concatenate([self.export_prices, np.nan_to_num(file_export.reshape(-1))])
+
+        self.import_price = self.import_prices[self.import_band]
+        self.export_price = self.export_prices[self.export_band]
+        self.digests = {}
+
+    def digest(self, prices=False):
+        """
+        Digest of the bands and cheap hours, with prices True of the prices as well, for the keys of saved results
+        """
+        if prices not in self.digests:
+            digest = hashlib.sha256()
+            for array in [self.cheap, self.import_band, self.export_band] + ([self.import_prices, self.export_prices] if prices else []):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self.digests[prices] = digest.hexdigest()
+        return self.digests[prices]
+
+    def bands(self, imports, exports):
+        """
+        Total 365 x slots grid imports and exports (negative) into the import and export bands
+        """
+        return (np.bincount(self.import_band.reshape(-1), weights=imports.reshape(-1), minlength=len(self.import_prices)),
+                np.bincount(self.export_band.reshape(-1), weights=exports.reshape(-1), minlength=len(self.export_prices)))
+
+    def price(self, flows):
+        """
+        Grid cost of the band totals from bands()
+        """
+        imports, exports = flows
+        return float(np.dot(imports, self.import_prices) + np.dot(exports, self.export_prices))
+
+# Tariff items of CONFIG, a compiled tariff is shared by every config with the same values
+TARIFF_KEYS = ['PRICE_DAY', 'PRICE_NIGHT', 'PRICE_FEEDIN', 'NIGHT_START', 'NIGHT_END', 'TARIFF', 'TARIFF_FILE', 'TARIFF_SCALE', 'SLOT_MINUTES']
+TARIFF_CACHE = {}
+TARIFF_CACHE_SIZE = 64
+
+def get_tariff(config):
+    """
+    The compiled tariff for config, compiled once for each distinct set of tariff values and tariff file version
+    """
+    key = [config[key] for key in TARIFF_KEYS]
+    if config['TARIFF_FILE'] and os.path.exists(config['TARIFF_FILE']):
+        key.append(os.path.getmtime(config['TARIFF_FILE']))
+    key = repr(key)
+    if key not in TARIFF_CACHE:
+        if len(TARIFF_CACHE) >= TARIFF_CACHE_SIZE:
+            TARIFF_CACHE.clear()
+        TARIFF_CACHE[key] = cl_tariff(config)
+    return TARIFF_CACHE[key]
+
+def set_query(url, **params):
+    """
+    Return url with query parameters added or replaced
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query.update(params)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, urllib.parse.urlencode(query), parts.fragment))
+
+def interval_time(stamp):
+    return datetime.fromisoformat(stamp.strip().replace('Z', '+00:00'))
+
+def offset_minutes(offset):
+    """
+    Minutes ahead of UTC of a timestamp offset such as Z, +01:00 or -05:00
+    """
+    if offset[:1] not in ('+', '-'):
+        return 0
+    minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+    return -minutes if offset[0] == '-' else minutes
+
+def fill_skipped(energy, present, offset, interval_offset, last_end, start):
+    """
+    When the clocks go forward between the interval ending at slot last_end and the next one starting at slot start
+    of the same day the local slots between them never exist, fill the ones with no data from the slot before
+    """
+    if offset is not None and last_end and start > last_end and offset_minutes(interval_offset) > offset_minutes(offset):
+        for slot in range(last_end, start):
+            if not present[slot]:
+                energy[slot] = energy[last_end - 1]
+                present[slot] = True
+
+class cl_api:
+    """ Octopus API client, pages are fetched concurrently over keep-alive connections """
+    def __init__(self, key, workers=4):
+        self.auth = 'Basic ' + base64.b64encode((key + ':').encode()).decode()
+        self.workers = max(1, int(workers))
+        self.local = threading.local()
+
+    def connection(self, parts, fresh=False):
+        # One pooled connection per host for each thread
+        if not hasattr(self.local, 'pool'):
+            self.local.pool = {}
+        key = (parts.scheme, parts.netloc)
+        if fresh and key in self.local.pool:
+            self.local.pool.pop(key).close()
+        if key not in self.local.pool:
+            if parts.scheme == 'https':
+                self.local.pool[key] = http.client.HTTPSConnection(parts.netloc, timeout=60)
+            else:
+                self.local.pool[key] = http.client.HTTPConnection(parts.netloc, timeout=60)
+        return self.local.pool[key]
+
+    def get(self, url, retries=3):
+        """
+        Fetch one page of JSON, a dropped keep-alive connection is reopened and retried
+        """
+        print("Fetching %s" % url)
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for attempt in range(retries):
+            conn = self.connection(parts, fresh=attempt > 0)
+            try:
+                conn.request('GET', path, headers={'Authorization' : self.auth, 'Accept' : 'application/json'})
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                if attempt == retries - 1:
+                    raise
+                continue
+            if response.status != 200:
+                raise ValueError("HTTP %d from %s" % (response.status, url))
+            return json.loads(data)
+
+    def pages(self, url):
+        """
+        Generator of every page in order, when the page count is known pages after the first are fetched concurrently
+        """
+        first = self.get(url)
+        yield first
+        page_next = first.get('next')
+        count = first.get('count')
+        page_size = len(first.get('results', []))
+
+        if page_next and count and page_size and 'page=' in page_next:
+            page_count = int(math.ceil(count / float(page_size)))
+            urls = [set_query(page_next, page=page) for page in range(2, page_count + 1)]
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                for page in pool.map(self.get, urls):
+                    yield page
+        else:
+            while page_next:
+                page = self.get(page_next)
+                yield page
+                page_next = page.get('next')
+
+    def update_cache(self, api, cache_dir, mpan, serial):
+        """
+        Download consumption after the last cached interval and append it to the cache, returns the cache file name
+        The cache is an Octopus style CSV in time order so an interrupted download resumes from the last complete page
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        filename = os.path.join(cache_dir, "consumption_%s_%s.csv" % (mpan, serial))
+
+        last_start = None
+        last_end = None
+        if os.path.exists(filename):
+            with open(filename, 'rb') as han:
+                han.seek(0, os.SEEK_END)
+                han.seek(max(0, han.tell() - 4096))
+                lines = han.read().decode().strip().split('\n')
+            fields = lines[-1].split(',')
+            if len(fields) >= 3 and not fields[0].startswith('Consumption'):
+                last_start = interval_time(fields[1])
+                last_end = fields[2].strip()
+        else:
+            with open(filename, 'w') as han:
+                han.write("Consumption (kWh), Start, End\n")
+
+        api = set_query(api, order_by='period')
+        if last_end:
+            api = set_query(api, period_from=last_end)
+
+        added = 0
+        with open(filename, 'a') as han:
+            for page in self.pages(api):
+                results = [(interval_time(result['interval_start']), result) for result in page.get('results', [])]
+                results.sort(key=lambda item: item[0])
+                rows = []
+                for start, result in results:
+                    if last_start is None or start > last_start:
+                        rows.append("%s, %s, %s\n" % (result['consumption'], result['interval_start'], result['interval_end']))
+                        last_start = start
+                han.write("".join(rows))
+                han.flush()
+                added += len(rows)
+        print("Downloaded %d new data points into %s" % (added, filename))
+        return filename
+
+def profile_usage(profile, total, slots=24):
+    """
+    Energy for each slot of a day from a 24 hour profile scaled to the annual total, each hour is split evenly into its slots
+    """
+    profile = np.array(profile, dtype=float)
+    profile = profile / profile.sum() * 100.0
+    per_hour = slots // 24
+    return np.repeat(profile * total / 100 / 365 / per_hour, per_hour)
+
+# Ways of filling missing hours in consumption data when PROFILE_BACKFILL is set
+BACKFILL_METHODS = ['profile', 'household', 'interpolate']
+
+class DataError(Exception):
+    """ Consumption data that can not be loaded or settings that can not be used, reported as an ERROR by the command line """
+
+class cl_load:
+    """ Load model """
+
+    def load(self, kw):
+        self.total_used += kw
+    
+    def create_profile(self, profile, total, create_day=None):
+        """
+        Fill the whole year (or just create_day) from a 24 hour profile scaled to the annual total
+        """
+        usage = profile_usage(profile, total, self.slots)
+
+        if create_day:
+            self.energy[create_day - 1] = usage
+            self.present[create_day - 1] = True
+        else:
+            self.energy[:] = usage
+            self.present[:] = True
+
+    def load_csv(self, filename):
+        results = []
+        with open(filename, 'r') as han:
+            last_hour = -1
+            for line in han:
+                if line:
+                    line = line.strip()
+                    fields = line.split(',')
+                    if not fields[0].startswith('Consumption'):
+                        point = {}
+                        point['consumption'] = float(fields[0])
+                        point['interval_start'] = fields[1]
+                        point['interval_end'] = fields[2]
+                        results.append(point)
+        return results
+
+    def read_csv(self, filename):
+        """
+        Stream an Octopus consumption CSV as (day_of_year, start slot, end slot, consumption, offset) intervals
+        """
+        days = {}
+        for date, start, end, consumption, offset in self.read_intervals(filename, offsets=True):
+            # Day of year is looked up once per date
+            day_of_year = days.get(date)
+            if day_of_year is None:
+                day_of_year = datetime.strptime(date, '%Y-%m-%d').timetuple().tm_yday
+                days[date] = day_of_year
+            yield day_of_year, start, end, consumption, offset
+
+    def read_intervals(self, filename, offsets=False):
+        """
+        Stream an Octopus consumption CSV as (date, start slot, end slot, consumption) intervals, date is YYYY-MM-DD
+        Timestamps have a fixed layout e.g. 2022-10-30T01:30:00+01:00 or 2022-10-30T01:30:00Z so are sliced
+        directly, the model works in local time so the offset is only added to the end of each interval with offsets True
+        """
+        minutes = int(self.config['SLOT_MINUTES'])
+        with open(filename, 'r') as han:
+            for line in han:
+                fields = line.split(',')
+                if len(fields) < 3 or fields[0].strip().startswith('Consumption'):
+                    continue
+                istart = fields[1].strip()
+                iend = fields[2].strip()
+                if istart[10:11] != 'T' or iend[10:11] != 'T' or istart[13:14] != ':' or iend[13:14] != ':':
+                    raise DataError("Bad interval in %s: %s" % (filename, line.strip()))
+                try:
+                    start = (int(istart[11:13]) * 60 + int(istart[14:16])) // minutes
+                    end = (int(iend[11:13]) * 60 + int(iend[14:16])) // minutes
+                except ValueError:
+                    raise DataError("Bad interval in %s: %s" % (filename, line.strip()))
+                if offsets:
+                    yield istart[:10], start, end, float(fields[0]), istart[19:]
+                else:
+                    yield istart[:10], start, end, float(fields[0])
+
+    def parse_results(self, results):
+        """
+        Change octopus results into (day_of_year, start slot, end slot, consumption, offset) intervals
+        """
+        minutes = int(self.config['SLOT_MINUTES'])
+        for result in results:
+            istart = result['interval_start']
+            iend   = result['interval_end']
+            energy = result['consumption']
+
+            start_date, start_time = istart.split('T')
+            end_date, end_time = iend.split('T')
+            start_time, offset_time = re.split('\+|Z', start_time)
+            end_time, offset_end_time = re.split('\+|Z', end_time)
+            start = datetime.strptime(start_date.strip() + " " + start_time, '%Y-%m-%d %H:%M:%S')
+            end   = datetime.strptime(end_date.strip()   + " " + end_time,   '%Y-%m-%d %H:%M:%S')
+            yield start.timetuple().tm_yday, (start.hour * 60 + start.minute) // minutes, (end.hour * 60 + end.minute) // minutes, energy, istart.strip()[19:]
+
+    def process_results(self, results):
+        """
+        Change octoput results into data points
+        """
+        self.accumulate(self.parse_results(results))
+
+    def accumulate(self, intervals):
+        """
+        Add (day_of_year, start slot, end slot, consumption, offset) intervals into the data for each slot
+        Intervals shorter than a slot are added together and longer ones are split evenly across their slots
+        The slots skipped when the clocks go forward are filled as in timeline_days()
+        """
+        energy_rows = self.energy.tolist()
+        present_rows = self.present.tolist()
+        last_hour = -1
+        last_day = None
+        offset = None
+
+        for day_of_year, hour_of_day_start, hour_of_day_end, energy, interval_offset in intervals:
+            hours = hour_of_day_end - hour_of_day_start
+            if (hours == 0):
+                hours = 1
+            elif hours < 0:
+                # Ends at or after midnight, the rest of the day is covered
+                hours = self.slots - hour_of_day_start
+
+            if day_of_year != last_day:
+                last_day = day_of_year
+                last_end = None
+            # Leap days beyond day 365 are not modelled
+            if day_of_year <= 365:
+                energy_day = energy_rows[day_of_year - 1]
+                present_day = present_rows[day_of_year - 1]
+                if interval_offset != offset:
+                    fill_skipped(energy_day, present_day, offset, interval_offset, last_end, hour_of_day_start)
+            offset = interval_offset
+            last_end = hour_of_day_start + hours
+            for hour in range(hour_of_day_start, hour_of_day_start + hours):
+                if day_of_year <= 365:
+                    if not present_day[hour]:
+                        energy_day[hour] = energy / hours
+                        present_day[hour] = True
+                    elif last_hour == hour_of_day_start:
+                        energy_day[hour] += energy / hours
+                    else:
+                        # If the data covers multiple years use the latest only
+                        energy_day[hour] = energy / hours
+
+                last_hour = hour_of_day_start
+
+        self.energy[:] = energy_rows
+        self.present[:] = present_rows
+    
+    def validate_data(self, show):
+        # Every missing hour is either filled in or is an error
+        missing = ~self.present
+        if missing.any():
+            if self.config['PROFILE_BACKFILL']:
+                self.fill_gaps(missing, self.config['BACKFILL_METHOD'])
+                hours = 24.0 / self.slots
+                print("WARN: Input data is incomplete, filled %g hours on %d days (%d whole days, longest gap %g hours) using %s" % (
+                      self.filled['hours'] * hours, self.filled['days'], self.filled['whole_days'], self.filled['longest'] * hours, self.filled['method']))
+            else:
+                index = np.flatnonzero(missing.any(axis=1))[0]
+                hours = np.flatnonzero(missing[index])
+                if len(hours) == self.slots:
+                    raise DataError("Input data is incomplete for day %d" % (index + 1))
+                else:
+                    raise DataError("Input data is incomplete for day %d hour %d" % (index + 1, hours[0] * 24 // self.slots))
+
+        # Count per hour and create hourly profile
+        self.hourly = self.energy.sum(axis=0)
+        total = sum(self.hourly.tolist())
+        self.hourly_profile = self.hourly / total
+        
+        # Show profile
+        if show:
+            self.show_profile()
+
+    def fill_gaps(self, missing, method):
+        """
+        Fill every missing hour in one pass and keep a summary of what was filled in self.filled
+        - profile: the configured PROFILE scaled to ANNUAL_USAGE
+        - household: the average of the hour over the days that have it
+        - interpolate: linear between the same hour on the nearest days either side that have it
+        An hour of the day with no data at all is filled from the profile
+        """
+        if method not in BACKFILL_METHODS:
+            raise DataError("Unknown BACKFILL_METHOD %s, must be one of %s" % (method, ", ".join(BACKFILL_METHODS)))
+        usage = profile_usage(self.config['PROFILE'], self.config['ANNUAL_USAGE'], self.slots)
+        known = self.present.any(axis=0)
+
+        if method == 'household':
+            counts = self.present.sum(axis=0)
+            average = np.where(self.present, self.energy, 0.0).sum(axis=0) / np.maximum(counts, 1)
+            fill = np.where(known, average, usage)[None, :]
+        elif method == 'interpolate':
+            days = np.arange(missing.shape[0])
+            fill = np.tile(usage, (missing.shape[0], 1))
+            for hour in np.flatnonzero(known):
+                have = self.present[:, hour]
+                fill[:, hour] = np.interp(days, days[have], self.energy[have, hour])
+        else:
+            fill = usage[None, :]
+
+        self.energy = np.where(missing, fill, self.energy)
+        self.present = np.ones(missing.shape, dtype=bool)
+
+        # Longest run of missing hours through the year
+        edges = np.diff(np.concatenate([[0], missing.reshape(-1).astype(np.int8), [0]]))
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        self.filled = {
+            'method' : method,
+            'hours' : int(missing.sum()),
+            'days' : int(missing.any(axis=1).sum()),
+            'whole_days' : int(missing.all(axis=1).sum()),
+            'longest' : int(runs.max()) if len(runs) else 0
+        }
+
+    def show_profile(self):
+        print("Total annual energy use: %0.2f kWh hourly profile:  " % sum(self.hourly.tolist()))
+        print("    ", end='')
+        hourly_profile = self.hourly_profile.reshape(24, -1).sum(axis=1)
+        for hour in range(24):
+            vstr = "%0.2f, " % (hourly_profile[hour] * 100.0)
+            print(vstr, end="")
+        print()
+
+    def snapshot_name(self, filename):
+        """
+        Snapshot file name from a hash of the source data and the settings used to validate it
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((LOAD_SNAPSHOT_VERSION, self.config['PROFILE_BACKFILL'], self.config['BACKFILL_METHOD'], list(self.config['PROFILE']),
+                            self.config['ANNUAL_USAGE'], self.slots)).encode())
+        with open(filename, 'rb') as han:
+            for block in iter(lambda: han.read(1024 * 1024), b''):
+                digest.update(block)
+        return os.path.join(self.config['LOAD_CACHE'], "load_%s.npy" % digest.hexdigest()[:32])
+
+    def save_snapshot(self, snapshot):
+        """
+        Save the validated data as one 366 x slots array, rows 0-364 are the energy per day and row 365 the profile
+        """
+        os.makedirs(os.path.dirname(snapshot) or '.', exist_ok=True)
+        temp = "%s.%d.tmp" % (snapshot, os.getpid())
+        with open(temp, 'wb') as han:
+            np.save(han, np.vstack([self.energy, self.hourly_profile]))
+        os.replace(temp, snapshot)
+
+    def load_snapshot(self, snapshot):
+        """
+        Memory map a saved snapshot, returns False if there isn't one
+        """
+        try:
+            data = np.load(snapshot, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if data.shape != (366, self.slots):
+            return False
+        self.snapshot = snapshot
+        self.energy = np.asarray(data[:365])
+        self.present = np.ones((365, self.slots), dtype=bool)
+        self.hourly = self.energy.sum(axis=0)
+        self.hourly_profile = np.asarray(data[365])
+        return True
+
+    def __getstate__(self):
+        # Worker processes map the snapshot again rather than being sent the data
+        state = dict(self.__dict__)
+        if state.get('snapshot'):
+            for key in ['energy', 'present', 'hourly', 'hourly_profile']:
+                del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('snapshot') and not self.load_snapshot(state['snapshot']):
+            raise ValueError("Load snapshot %s is missing" % state['snapshot'])
+
+    def reset(self):
+        self.total_used = 0
+
+    def clear(self):
+        # Energy used per [day - 1][slot] and whether that slot has been loaded
+        self.energy = np.zeros((365, self.slots))
+        self.present = np.zeros((365, self.slots), dtype=bool)
+
+    def __init__(self, filename, show, profile=None, total=3000.0, apimode=False, config=CONFIG):
+        self.config = config
+        self.slots = day_slots(config)
+        self.filled = None
+        self.clear()
+        self.reset()
+        self.snapshot = None
+        self.source = None
+        
+        if apimode:
+            filename = self.load_api()
+        if filename:
+            self.source = os.path.abspath(filename)
+
+        if filename:
+            # Use the snapshot of this data if it has already been loaded and validated
+            snapshot = self.snapshot_name(filename) if self.config['LOAD_CACHE'] else None
+            if not snapshot or not self.load_snapshot(snapshot):
+                self.accumulate(self.read_csv(filename))
+                self.validate_data(False)
+                if snapshot:
+                    self.save_snapshot(snapshot)
+        else:
+            self.create_profile(profile, total)
+            self.validate_data(False)
+
+        if show:
+            self.show_profile()
+        
+                            
+    def get_load(self, day, hour):
+        if 1 <= day <= 365:
+            return float(self.energy[day - 1, hour])
+        return 0
+
+    def day(self, day):
+        """
+        Load for each hour of one day
+        """
+        return self.energy[day - 1]
+
+    def table(self):
+        """
+        Load for the whole year as a 365 x slots array (row 0 is day 1), shared so must not be modified
+        """
+        return self.energy
+
+    def total(self):
+        return float(self.energy.sum())
+
+    def show(self):
+        print ("Total energy load used %lf kWh" % self.total_used)
+
+    def load_api(self):
+        """
+        Bring the local cache of Octopus API consumption up to date, returns the cache file name
+        """
+        if (not self.config['API_KEY']) or (not self.config['API_MPAN']) or (not self.config['API_SERIAL']):
+            raise DataError("You must set API_KEY, API_MPAN and API_SERIAL to load from Octopus API")
+
+        api = cl_api(self.config['API_KEY'], self.config['API_WORKERS'])
+        try:
+            return api.update_cache(self.config['API_CONSUMPTION'] % (self.config['API_MPAN'], self.config['API_SERIAL']), self.config['API_CACHE'], self.config['API_MPAN'], self.config['API_SERIAL'])
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise DataError("Failed to fetch consumption from Octopus API: %s" % e)
+
+class cl_batch:
+    """ Batched scenario model, steps many scenarios through the year in one pass """
+    def __init__(self, configs):
+        self.configs = configs
+        self.count = len(configs)
+
+        def column(key, dtype=float):
+            return np.array([config[key] for config in configs], dtype=dtype)
+
+        # Battery in kw and loss %
+        self.battery_max = column('BATTERY_SIZE') * column('BATTERY_DOD')
+        self.battery_loss = column('BATTERY_LOSS')
+        self.peak_draw = column('BATTERY_PEAK_DRAW')
+        self.charge_rate = column('BATTERY_MAX_CHARGE_RATE')
+        self.charge_night = column('BATTERY_CHARGE_NIGHT', bool)
+        self.dynamic_charge = column('DYNAMIC_CHARGE')
+
+        # Panel in kw and loss %
+        self.solar_size = column('SOLAR_SIZE')
+        self.efficiency = 0.627 * column('SOLAR_YIELD')
+
+        # Compiled tariff per scenario, prices and cheap hours indexed [hour of year][scenario]
+        self.tariffs = [get_tariff(config) for config in configs]
+        self.price_import = np.stack([tariff.import_price.reshape(-1) for tariff in self.tariffs], axis=1)
+        self.price_export = np.stack([tariff.export_price.reshape(-1) for tariff in self.tariffs], axis=1)
+        self.cheap = np.stack([tariff.cheap.reshape(-1) for tariff in self.tariffs], axis=1)
+
+    def run(self, load_table, sun_table, trace=None):
+        """
+        Run every scenario through one year of 365 x slots load and sun hours, sun_table can instead have one table per scenario
+        Returns the annual grid cost per scenario, the energy in each tariff band is kept in self.flows
+        The trace of each slot of the scenarios listed in trace is kept in self.trace
+        """
+        count = self.count
+        bmax = self.battery_max
+        loss = self.battery_loss
+
+        # Rate limits are in kW, the energy per slot depends on the slot length
+        slots = load_table.shape[-1]
+        charge_rate = self.charge_rate * (24.0 / slots)
+        peak_draw = self.peak_draw * (24.0 / slots)
+
+        # Solar production has no state so compute it for the whole year up front, indexed [hour of year][scenario]
+        solar = (self.solar_size[:, None] * sun_table.reshape(-1, load_table.size)) * self.efficiency[:, None]
+        spare_year = np.ascontiguousarray((solar - load_table.reshape(1, -1)).T)
+
+        charge = np.zeros(count)
+        target = bmax.copy()
+        undersize = np.zeros(count)
+        dynamic = self.dynamic_charge != 0
+        use_dynamic = dynamic.any()
+
+        imports = np.zeros(spare_year.shape)
+        exports = np.zeros(spare_year.shape)
+        self.cost = np.zeros(count)
+
+        if trace:
+            trace = np.array(trace, dtype=int)
+            self.trace = cl_trace(spare_year.shape[0], len(trace), slots)
+            load_year = load_table.reshape(-1)
+
+        for index in range(spare_year.shape[0]):
+            hour = index % slots
+
+            # Same as cl_battery.hour() - adjust target charge level based on yesterday
+            if hour == 0:
+                last_charge_level = charge
+                last_undersize = undersize
+                undersize = np.zeros(count)
+                if use_dynamic:
+                    grow = np.maximum(np.maximum(0, target + last_undersize), self.dynamic_charge)
+                    shrink = np.maximum(np.minimum(bmax, target - last_charge_level + 1.0), self.dynamic_charge)
+                    adjusted = np.where(last_undersize > 0.0, grow, np.where(last_charge_level > 1.0, shrink, target))
+                    target = np.where(dynamic, np.minimum(adjusted, bmax), target)
+
+            spare = spare_year[index]
+            night = self.cheap[index]
+            surplus = spare > 0
+            night_charge = ~surplus & night & self.charge_night
+            day_draw = ~surplus & ~night_charge
+
+            # Surplus solar charges the battery, the rest is fed in
+            amount = spare * loss
+            amount = np.where(amount + charge > bmax, bmax - charge, amount)
+            left_over = spare - (amount / loss)
+
+            # Charge the battery on the cheap rate up to the target
+            to_battery = np.minimum(np.maximum(target - charge, 0) / loss, charge_rate)
+            night_amount = to_battery * loss
+            night_amount = np.where(night_amount + charge > bmax, bmax - charge, night_amount)
+
+            # Otherwise draw from the battery during the day
+            wanted = -spare
+            drawn = np.where(night, 0.0, np.minimum(np.minimum(charge, wanted), peak_draw))
+            balance = wanted - drawn
+
+            charge = np.where(surplus, charge + amount, np.where(night_charge, charge + night_amount, charge - drawn))
+            undersize = np.where(day_draw & (balance > 0), undersize + balance, undersize)
+
+            # Grid accounting, at most one draw per scenario per hour as in cl_grid.draw()
+            grid = np.where(surplus, -left_over, np.where(night_charge, to_battery - spare, balance))
+            imported = ~surplus & (grid > 0)
+            exported = surplus & (left_over > 0)
+            imports[index] = np.where(imported, grid, 0.0)
+            exports[index] = np.where(exported, grid, 0.0)
+            self.cost += imports[index] * self.price_import[index] + exports[index] * self.price_export[index]
+
+            if trace is not None and len(trace):
+                mode = np.where(surplus, 0, np.where(night_charge, 1, 2))
+                charged = np.where(surplus, spare - left_over, np.where(night_charge, to_battery, balance + spare))
+                self.trace.record(index, mode, (np.full(count, load_year[index]), solar[:, index], charged, grid, charge, target, undersize, self.cost), trace)
+
+        self.flows = [tariff.bands(imports[:, scenario], exports[:, scenario]) for scenario, tariff in enumerate(self.tariffs)]
+        return self.cost
+
+# Rows of the kernel output
+KERNEL_COLUMNS = ['charge_battery', 'draw_grid', 'battery_level', 'target_charge_level', 'battery_undersize', 'cost']
+
+def scenario_kernel(spare, cheap, price_import, price_export, import_band, export_band, bmax, loss, peak_draw, charge_rate, charge_night,
+                    dynamic_charge, mode, out, imports, exports, start, settle, days, state, slots):
+    """
+    The hourly battery and grid state machine of run_scenario for one scenario over flat arrays
+    spare is solar less load for each hour, mode and the KERNEL_COLUMNS rows of out are filled in for each hour
+    and the energy imported and exported is totalled into the tariff bands in imports and exports
+    The run starts at hour start from the charge, target, undersize and cost in state and records the first three
+    at the start of each day of slots in days. From hour settle on (never if negative) it stops at the first day that starts
+    in the state already recorded in days, as the rest of the year would then repeat. Returns the hour it stopped at
+    Kept to plain loops and floats so numba can compile it
+    """
+    charge = state[0]
+    target = state[1]
+    undersize = state[2]
+    cost = state[3]
+    hours = len(spare)
+    charged_out, grid_out, charge_out, target_out, undersize_out, cost_out = out[0], out[1], out[2], out[3], out[4], out[5]
+    for index in range(start, hours):
+        # Same as cl_battery.hour() - adjust target charge level based on yesterday
+        if index % slots == 0:
+            day = index // slots
+            day_state = days[day]
+            if settle >= 0 and index >= settle and charge == day_state[0] and target == day_state[1] and undersize == day_state[2]:
+                return index
+            day_state[0] = charge
+            day_state[1] = target
+            day_state[2] = undersize
+            last_charge_level = charge
+            last_undersize = undersize
+            undersize = 0.0
+            if dynamic_charge:
+                if last_undersize > 0.0:
+                    target = max(max(0.0, target + last_undersize), dynamic_charge)
+                elif last_charge_level > 1.0:
+                    target = max(min(bmax, target - last_charge_level + 1.0), dynamic_charge)
+                target = min(target, bmax)
+
+        energy = spare[index]
+        imported = 0.0
+        exported = 0.0
+        if energy > 0:
+            # Charge battery, feed in the rest
+            amount = energy * loss
+            if amount + charge > bmax:
+                amount = bmax - charge
+            left_over = energy - (amount / loss)
+            charge += amount
+            if left_over > 0:
+                exported = -left_over
+                cost += price_export[index] * exported
+            mode[index] = 0
+            charged = energy - left_over
+            grid = -left_over
+        elif cheap[index] and charge_night:
+            # Charge battery on cheap rate up to the target
+            to_battery = min(max(target - charge, 0.0) / loss, charge_rate)
+            grid = to_battery - energy
+            if grid > 0:
+                imported = grid
+                cost += price_import[index] * grid
+            amount = to_battery * loss
+            if amount + charge > bmax:
+                amount = bmax - charge
+            charge += amount
+            mode[index] = 1
+            charged = to_battery
+        else:
+            # Draw from the battery outside the cheap rate, then the grid
+            balance = -energy
+            if not cheap[index]:
+                drawn = min(min(charge, balance), peak_draw)
+                charge -= drawn
+                balance -= drawn
+            if balance > 0:
+                imported = balance
+                cost += price_import[index] * balance
+                undersize += balance
+            mode[index] = 2
+            charged = balance + energy
+            grid = balance
+
+        imports[import_band[index]] += imported
+        exports[export_band[index]] += exported
+        charged_out[index] = charged
+        grid_out[index] = grid
+        charge_out[index] = charge
+        target_out[index] = target
+        undersize_out[index] = undersize
+        cost_out[index] = cost
+
+    day_state = days[hours // slots]
+    day_state[0] = charge
+    day_state[1] = target
+    day_state[2] = undersize
+    state[0] = charge
+    state[1] = target
+    state[2] = undersize
+    state[3] = cost
+    return hours
+
+def kernel_state(config):
+    """
+    Starting state of scenario_kernel, an empty battery targeting a full charge
+    """
+    return np.array([0.0, float(config['BATTERY_SIZE'] * config['BATTERY_DOD']), 0.0, 0.0])
+
+def kernel_args(config, tariff, slots, rows=None):
+    """
+    The tariff and battery arguments of scenario_kernel for config, from cheap to dynamic_charge
+    The tariff covers the whole year or only the days of the year in rows
+    """
+    tables = [tariff.cheap, tariff.import_price, tariff.export_price, tariff.import_band, tariff.export_band]
+    if rows is not None:
+        tables = [table[rows] for table in tables]
+    return [table.reshape(-1) for table in tables] + [
+        float(config['BATTERY_SIZE'] * config['BATTERY_DOD']), float(config['BATTERY_LOSS']),
+        float(config['BATTERY_PEAK_DRAW'] * (24.0 / slots)), float(config['BATTERY_MAX_CHARGE_RATE'] * (24.0 / slots)),
+        bool(config['BATTERY_CHARGE_NIGHT']), float(config['DYNAMIC_CHARGE'])]
+
+# Compile the kernel when numba is installed
+if numba:
+    scenario_kernel = numba.njit(cache=True)(scenario_kernel)
+else:
+    python_kernel = scenario_kernel
+
+    def scenario_kernel(spare, cheap, price_import, price_export, import_band, export_band, bmax, loss, peak_draw, charge_rate, charge_night,
+                        dynamic_charge, mode, out, imports, exports, start, settle, days, state, slots):
+        """
+        scenario_kernel without numba, Python indexes lists far faster than arrays so it runs on list copies of the
+        arrays and the results are copied back
+        """
+        if start == 0 and settle < 0:
+            # Every hour is written so the lists start empty
+            results = [[0] * len(mode), [[0.0] * len(mode) for row in out]]
+        else:
+            results = [mode.tolist(), out.tolist()]
+        results += [imports.tolist(), exports.tolist(), days.tolist(), state.tolist()]
+        stop = python_kernel(spare.tolist(), cheap.tolist(), price_import.tolist(), price_export.tolist(), import_band.tolist(),
+                             export_band.tolist(), bmax, loss, peak_draw, charge_rate, charge_night, dynamic_charge,
+                             *results[:4], start, settle, results[4], results[5], slots)
+        for array, values in zip([mode, out, imports, exports, days, state], results):
+            array[...] = values
+        return stop
+
+# Without numba the kernel is used for up to this many heuristic scenarios, the batch engine for more
+PYTHON_KERNEL_SCENARIOS = 64
+
+class cl_kernel:
+    """ Scenario model stepping each scenario through the year in turn with scenario_kernel, compiled when numba is installed """
+    def __init__(self, configs):
+        self.configs = configs
+        self.count = len(configs)
+        self.tariffs = [get_tariff(config) for config in configs]
+
+    def run(self, load_table, sun_table, trace=None):
+        """
+        Same as cl_batch.run()
+        """
+        hours = load_table.size
+        slots = load_table.shape[-1]
+        load_year = load_table.reshape(-1)
+        sun_year = sun_table.reshape(-1, hours)
+        self.cost = np.zeros(self.count)
+        self.flows = []
+        if trace:
+            self.trace = cl_trace(hours, len(trace), slots)
+
+        mode = np.zeros(hours, dtype=np.int8)
+        out = np.zeros((len(KERNEL_COLUMNS), hours))
+        days = np.zeros((hours // slots + 1, 3))
+        for scenario, (config, tariff) in enumerate(zip(self.configs, self.tariffs)):
+            solar = (config['SOLAR_SIZE'] * sun_year[scenario if len(sun_year) > 1 else 0]) * (0.627 * config['SOLAR_YIELD'])
+            imports = np.zeros(len(tariff.import_prices))
+            exports = np.zeros(len(tariff.export_prices))
+            scenario_kernel(solar - load_year, *kernel_args(config, tariff, slots), mode, out, imports, exports, 0, -1, days,
+                            kernel_state(config), slots)
+            self.cost[scenario] = out[5, -1]
+            self.flows.append((imports, exports))
+
+            if trace and scenario in trace:
+                column = list(trace).index(scenario)
+                self.trace.mode[:, column] = mode
+                self.trace.columns['load'][:, column] = load_year
+                self.trace.columns['solar_produce'][:, column] = solar
+                for index, name in enumerate(KERNEL_COLUMNS):
+                    self.trace.columns[name][:, column] = out[index]
+        return self.cost
+
+class cl_dispatch:
+    """ Cost optimal battery dispatch by dynamic programming, the cost to go is kept on a grid of charge levels and interpolated between them """
+    def __init__(self, configs):
+        self.configs = configs
+        self.count = len(configs)
+
+        def column(key, dtype=float):
+            return np.array([config[key] for config in configs], dtype=dtype)
+
+        self.battery_max = column('BATTERY_SIZE') * column('BATTERY_DOD')
+        self.battery_loss = column('BATTERY_LOSS')
+        self.peak_draw = column('BATTERY_PEAK_DRAW')
+        self.charge_rate = column('BATTERY_MAX_CHARGE_RATE')
+        if len(set(column('DISPATCH_STEPS'))) > 1:
+            raise ValueError("Optimal dispatch solves every scenario of a run at the same DISPATCH_STEPS")
+        self.steps = max(1, int(configs[0]['DISPATCH_STEPS']))
+        self.solar_size = column('SOLAR_SIZE')
+        self.efficiency = 0.627 * column('SOLAR_YIELD')
+
+        # Compiled tariff per scenario, prices and cheap hours indexed [hour of year][scenario]
+        self.tariffs = [get_tariff(config) for config in configs]
+        self.price_import = np.stack([tariff.import_price.reshape(-1) for tariff in self.tariffs], axis=1)
+        self.price_export = np.stack([tariff.export_price.reshape(-1) for tariff in self.tariffs], axis=1)
+        self.cheap = np.stack([tariff.cheap.reshape(-1) for tariff in self.tariffs], axis=1)
+
+    def run(self, load_table, sun_table, trace=None):
+        """
+        Find the cheapest schedule for every scenario through one year of 365 x slots load and sun hours (one table or one per scenario)
+        Spare solar charges the battery without a limit as in run_scenario, the grid can add up to BATTERY_MAX_CHARGE_RATE
+        (measured before losses) at any time and the battery discharges up to BATTERY_PEAK_DRAW to cover the house load,
+        it does not export to the grid. Besides moving to any charge level each hour can charge at the exact limit, store
+        only the spare solar or cover the exact demand, so the battery is not held back by the spacing of the levels
+        Returns the annual grid cost per scenario, the energy in each tariff band is kept in self.flows like cl_batch
+        """
+        count = self.count
+        hours = load_table.size
+        slots = load_table.shape[-1]
+        steps = self.steps
+        levels = self.battery_max[:, None] * np.linspace(0.0, 1.0, steps + 1)[None, :]
+        spacing = np.where(self.battery_max > 0, self.battery_max / steps, 1.0)
+        loss = self.battery_loss
+        charge_rate = self.charge_rate * (24.0 / slots)
+        peak_draw = self.peak_draw * (24.0 / slots)
+
+        # Load less solar for each hour, positive is demand from the house
+        solar = (self.solar_size[:, None] * sun_table.reshape(-1, load_table.size)) * self.efficiency[:, None]
+        demand = load_table.reshape(1, -1) - solar
+
+        def shaped(column, like):
+            return column.reshape(-1, *([1] * (like.ndim - 1)))
+
+        def limits(change):
+            """ Energy taken from the house bus for each change in stored energy and whether it is within BATTERY_PEAK_DRAW """
+            return np.where(change > 0, change / shaped(loss, change), change), -change <= shaped(peak_draw, change) + 1e-9
+
+        def hour_cost(index, change, bus, drawable):
+            """ Grid energy and cost of each change in stored energy, infinite where it is beyond the battery limits """
+            base = shaped(demand[:, index], change)
+            feasible = drawable & (bus <= np.maximum(-base, 0.0) + shaped(charge_rate, change) + 1e-9)
+            # Discharging beyond the house demand is wasted rather than exported
+            net = np.where(change < 0, np.maximum(base + change, np.minimum(base, 0.0)), base + bus)
+            cost = np.where(net > 0, shaped(self.price_import[index], change) * net, shaped(self.price_export[index], change) * net)
+            return net, np.where(feasible, cost, np.inf)
+
+        def exact_moves(index, stored):
+            """ Change in stored energy to charge at the limit, store the spare solar or cover the demand from stored [scenario][...] """
+            base = shaped(demand[:, index], stored)
+            spare = np.maximum(-base, 0.0)
+            room = shaped(self.battery_max, stored) - stored
+            return np.stack([np.minimum((spare + shaped(charge_rate, stored)) * shaped(loss, stored), room),
+                             np.minimum(spare * shaped(loss, stored), room),
+                             -np.minimum(np.minimum(np.maximum(base, 0.0), shaped(peak_draw, stored)), stored)], axis=-1)
+
+        def interpolate(value, stored):
+            """ Cost to go at any stored energy [scenario][...] from its value at each level """
+            position = np.clip(stored / shaped(spacing, stored), 0.0, steps)
+            lower = np.minimum(position.astype(int), steps - 1)
+            fraction = position - lower
+            lower = lower.reshape(count, -1)
+            below = np.take_along_axis(value, lower, axis=1).reshape(stored.shape)
+            above = np.take_along_axis(value, lower + 1, axis=1).reshape(stored.shape)
+            return below + (above - below) * fraction
+
+        # Backward pass for the cost to go from each level at the start of each hour
+        change = levels[:, None, :] - levels[:, :, None]
+        bus, drawable = limits(change)
+        values = np.empty((hours + 1, count, steps + 1))
+        values[hours] = 0.0
+        for index in range(hours - 1, -1, -1):
+            value = values[index + 1]
+            cost = hour_cost(index, change, bus, drawable)[1] + value[:, None, :]
+            moves = exact_moves(index, levels)
+            exact = hour_cost(index, moves, *limits(moves))[1] + interpolate(value, levels[:, :, None] + moves)
+            values[index] = np.minimum(cost.min(axis=2), exact.min(axis=2))
+
+        # Forward pass from an empty battery choosing each move against the cost to go and totalling the energy in each band
+        imports = np.zeros((hours, count))
+        exports = np.zeros((hours, count))
+        self.cost = np.zeros(count)
+        scenarios = np.arange(count)
+        state = np.zeros(count)
+
+        if trace:
+            trace = np.array(trace, dtype=int)
+            self.trace = cl_trace(hours, len(trace), slots)
+            load_year = load_table.reshape(-1)
+
+        for index in range(hours):
+            moves = np.concatenate([levels - state[:, None], exact_moves(index, state[:, None])[:, 0]], axis=1)
+            bus, drawable = limits(moves)
+            net, cost = hour_cost(index, moves, bus, drawable)
+            choice = (cost + np.concatenate([values[index + 1], interpolate(values[index + 1], state[:, None] + moves[:, steps + 1:])], axis=1)).argmin(axis=1)
+            step = moves[scenarios, choice]
+            step_bus = bus[scenarios, choice]
+            net = net[scenarios, choice]
+            night = self.cheap[index]
+            imported = net > 0
+            imports[index] = np.where(imported, net, 0.0)
+            exports[index] = np.where(imported, 0.0, net)
+            self.cost += cost[scenarios, choice]
+            state = np.clip(state + step, 0.0, self.battery_max)
+
+            if trace is not None and len(trace):
+                mode = np.where(demand[:, index] < 0, 0, np.where(imported & night & (step > 0), 1, 2))
+                self.trace.record(index, mode, (np.full(count, load_year[index]), solar[:, index], step_bus, net, state,
+                                                self.battery_max, np.zeros(count), self.cost), trace)
+
+        self.flows = [tariff.bands(imports[:, scenario], exports[:, scenario]) for scenario, tariff in enumerate(self.tariffs)]
+        return self.cost
+
+def run_scenario(show, show_base, load, config=CONFIG):
+    if show:
+        print ("---------- BATTERY %f SOLAR %f COST %0.2f--------" % (config['BATTERY_SIZE'], config['SOLAR_SIZE'], config['EQUIPMENT_COST']))
+
+    slots = day_slots(config)
+    if show or show_base:
+        log = cl_trace(365 * slots, 1, slots)
+    else:
+        log = None
+
+    # Battery in kw and loss %
+    battery = cl_battery(config['BATTERY_SIZE'], config['BATTERY_LOSS'], config['BATTERY_DOD'], config)
+
+    # Panel in kw and loss %
+    panel = cl_panels(config['SOLAR_SIZE'], 0.627 * config['SOLAR_YIELD'])
+
+    # Sunrise data
+    sun = cl_sun(config['SUNRISE'], slot_minutes=config['SLOT_MINUTES'])
+
+    # Reset load data
+    load.reset()
+
+    # Create grid
+    grid = cl_grid(config)
+
+    # One year
+    day = 1
+    while (day <= 365):
+        hour = 0
+        while (hour < slots):
+            hours = sun.hours(day, hour)
+            solar_energy = panel.energy(hours)
+            battery.hour(hour)
+
+            # Hour of the day the slot starts at for the tariff
+            clock = hour * 24.0 / slots
+        
+            use = load.get_load(day, hour)
+            load.load(use)
+        
+            spare_energy = solar_energy - use
+            if spare_energy > 0:
+              # Charge battery?
+              left_over_energy = battery.do_charge(spare_energy)
+              # Feed in?
+              if left_over_energy > 0:
+                  grid.draw(-left_over_energy, clock)        
+              if log:      
+                  log.row("Spare", day, hour, use, solar_energy, spare_energy - left_over_energy, -left_over_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
+            else:
+                # Charge battery on cheap rate?
+                if is_night_rate(clock, config) and config['BATTERY_CHARGE_NIGHT']:
+                    to_battery = min(battery.can_charge(), config['BATTERY_MAX_CHARGE_RATE'] * (24.0 / slots)) # max charge rate
+                    grid.draw(to_battery - spare_energy, clock)
+                    battery.do_charge(to_battery)
+                    if log:      
+                        log.row("Night", day, hour, use, solar_energy, to_battery, to_battery - spare_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
+                else:
+                    if is_night_rate(clock, config):
+                        # draw from grid
+                        balance_energy = -spare_energy
+                    else:
+                        # Draw from battery
+                        balance_energy = battery.draw(-spare_energy)
+                    if balance_energy > 0:
+                        # Buy from grid?
+                        grid.draw(balance_energy, clock)
+                        battery.track_undersize(balance_energy, hour)
+                    if log:      
+                        log.row("Day", day, hour, use, solar_energy, balance_energy + spare_energy, balance_energy, battery.charge, battery.target_charge_level, battery.undersize, grid.cost)
+                
+            hour += 1
+        day += 1
+
+    if log:
+        log.save(*trace_names(config, show_base and not show), format=config['TRACE_FORMAT'])
+
+    if show:
+        load.show()
+        panel.show()
+        battery.show()
+        grid.show()
+
+    return grid.cost
+
+def run_scenarios(configs, load):
+    """
+    Run a list of scenario configurations through one year together, returns the annual cost of each
+    """
+    sun = cl_sun(configs[0]['SUNRISE'], slot_minutes=configs[0]['SLOT_MINUTES'])
+    batch = cl_batch(configs)
+    return batch.run(load.table(), sun.table())
+
+# CONFIG items apart from the tariff that change the energy flows, everything else (costs, years) only changes how they are priced
+PHYSICS_KEYS = ['BATTERY_SIZE', 'BATTERY_DOD', 'BATTERY_LOSS', 'BATTERY_PEAK_DRAW', 'BATTERY_MAX_CHARGE_RATE', 'BATTERY_CHARGE_NIGHT',
+                'DYNAMIC_CHARGE', 'SOLAR_SIZE', 'SOLAR_YIELD', 'SUNRISE', 'DISPATCH', 'DISPATCH_STEPS', 'SLOT_MINUTES']
+
+# Engine for each DISPATCH mode
+DISPATCH_ENGINES = {
+    'heuristic' : 'cl_batch',
+    'optimal' : 'cl_dispatch'
+}
+
+# Most scenarios given to the optimal dispatch engine at once, bounds the memory used for the policy
+DISPATCH_CHUNK = 16
+
+def scenario_engine(config, count=1):
+    """
+    Name of the engine class for count scenarios in the DISPATCH mode of config, None if the mode is unknown
+    """
+    engine = DISPATCH_ENGINES.get(config['DISPATCH'])
+    if engine == 'cl_batch' and config['JIT'] and (numba or count <= PYTHON_KERNEL_SCENARIOS):
+        engine = 'cl_kernel'
+    return engine
+
+def physics_key(config):
+    """
+    Key of the energy flows of config, the tariff is keyed by the digest of its compiled bands and cheap slots
+    as the prices can change which slots are cheap, optimal dispatch depends on the prices as well
+    """
+    return repr([config[key] for key in PHYSICS_KEYS] + [get_tariff(config).digest(config['DISPATCH'] == 'optimal')])
+
+class cl_checkpoint:
+    """
+    Daily checkpoints of the heuristic model for one household, so that when new consumption data only changes
+    some days the year is resumed from the day before the change instead of simulated again
+    Each scenario keeps the battery charge, target charge level and undersize at the start of every day
+    and the hourly grid draw and mode that its tariff band totals are summed from
+    """
+    def __init__(self, filename, table):
+        self.filename = filename
+        self.table = table
+        self.entries = {}
+        self.used = {}
+        self.stats = {'reused' : 0, 'resumed' : 0, 'full' : 0, 'days' : 0}
+
+        # Days whose consumption differs from the previous run, None if there wasn't one
+        self.changed = None
+        try:
+            with np.load(filename) as data:
+                previous = data['load']
+                keys, digests, days, grid, mode = data['keys'], data['digests'], data['days'], data['grid'], data['mode']
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return
+        if previous.shape != table.shape:
+            return
+        self.changed = np.flatnonzero((previous != table).any(axis=1))
+        for index, key in enumerate(keys):
+            self.entries[str(key)] = (str(digests[index]), days[index], grid[index], mode[index])
+
+    @staticmethod
+    def digest(config, sun):
+        """
+        Digest of the inputs outside the physics key, the sun table and tariff hours
+        """
+        return hashlib.sha256(sun.tobytes() + repr((RESULTS_VERSION, get_tariff(config).digest())).encode()).hexdigest()[:32]
+
+    def bands(self, config, grid, mode):
+        """
+        Tariff band totals of the hourly grid draw, the same as scenario_kernel totals them
+        """
+        imported = np.where((mode != 0) & (grid > 0), grid, 0.0)
+        exported = np.where((mode == 0) & (grid < 0), grid, 0.0)
+        return get_tariff(config).bands(imported, exported)
+
+    def resume(self, key, config, sun):
+        """
+        Band totals of a heuristic scenario from its checkpoint, None if it has none for these inputs
+        The kernel resumes at the first changed day and stops once a day after the last change starts in the same
+        state as before, the recorded hours are reused from there on
+        """
+        entry = self.entries.get(key)
+        digest = self.digest(config, sun)
+        if self.changed is None or entry is None or entry[0] != digest:
+            return None
+        days, grid, mode = entry[1].copy(), entry[2], entry[3].copy()
+        hours = self.table.size
+        slots = self.table.shape[1]
+        if len(self.changed):
+            start = int(self.changed[0]) * slots
+            settle = (int(self.changed[-1]) + 1) * slots
+            day = start // slots
+            tariff = get_tariff(config)
+            solar = (config['SOLAR_SIZE'] * sun.reshape(-1)) * (0.627 * config['SOLAR_YIELD'])
+            out = np.zeros((len(KERNEL_COLUMNS), hours))
+            out[1] = grid
+            stop = scenario_kernel(solar - self.table.reshape(-1), *kernel_args(config, tariff, slots), mode, out,
+                                   np.zeros(len(tariff.import_prices)), np.zeros(len(tariff.export_prices)),
+                                   start, settle, days, np.array([days[day, 0], days[day, 1], days[day, 2], 0.0]), slots)
+            grid = out[1].copy()
+            self.stats['resumed'] += 1
+            self.stats['days'] += (stop - start) // slots
+        else:
+            self.stats['reused'] += 1
+        self.used[key] = (digest, days, grid, mode)
+        return self.bands(config, grid, mode)
+
+    def record(self, key, config, sun, trace):
+        """
+        Checkpoint a scenario from the hourly trace of a full run
+        """
+        grid = np.array(trace.column('draw_grid'))
+        days = np.zeros((trace.rows // trace.slots + 1, 3))
+        days[0] = kernel_state(config)[:3]
+        for column, name in enumerate(['battery_level', 'target_charge_level', 'battery_undersize']):
+            days[1:, column] = trace.column(name)[trace.slots - 1::trace.slots]
+        self.used[key] = (self.digest(config, sun), days, grid, np.array(trace.mode[:, 0]))
+        self.stats['full'] += 1
+
+    def save(self):
+        """
+        Save the checkpoints of the scenarios used in this run, unless they were all reused as they were
+        """
+        if not self.stats['resumed'] and not self.stats['full']:
+            return
+        keys = sorted(self.used)
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        temp = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(temp, 'wb') as han:
+            np.savez(han, load=self.table, keys=np.array(keys, dtype=str), digests=np.array([self.used[key][0] for key in keys], dtype=str),
+                     days=np.array([self.used[key][1] for key in keys]).reshape(len(keys), -1, 3),
+                     grid=np.array([self.used[key][2] for key in keys]).reshape(len(keys), -1),
+                     mode=np.array([self.used[key][3] for key in keys], dtype=np.int8).reshape(len(keys), -1))
+        os.replace(temp, self.filename)
+
+    def show(self):
+        print("Checkpoints: %d scenarios reused, %d resumed simulating %d days, %d simulated in full" % (
+              self.stats['reused'], self.stats['resumed'], self.stats['days'], self.stats['full']))
+
+def load_checkpoint(load, config=CONFIG):
+    """
+    Checkpoints for the consumption data source of load, None if CHECKPOINTS is off or the load isn't from a file
+    """
+    if not config['CHECKPOINTS'] or not config['LOAD_CACHE'] or not load.source:
+        return None
+    digest = hashlib.sha256(load.source.encode()).hexdigest()[:32]
+    return cl_checkpoint(os.path.join(config['LOAD_CACHE'], "checkpoint_%s.npz" % digest), load.table())
+
+class cl_results:
+    """
+    Simulated tariff band totals kept on disk between runs and shared by worker processes, keyed by a digest of
+    RESULTS_VERSION, the physics of the config, its tariff, the load and the sun table. The least recently used results are dropped
+    once the file grows beyond its limit
+    """
+    def __init__(self, filename, limit):
+        self.filename = filename
+        self.limit = limit
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        # Each process opens its own connection, a forked worker must not use its parent's
+        if self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, imports BLOB, exports BLOB, size INTEGER, used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self.pid = os.getpid()
+        return self.connection
+
+    @staticmethod
+    def key(config, load_digest, sun_digest):
+        """
+        Key of the results of config for the load and sun table digests
+        """
+        return hashlib.sha256(repr((RESULTS_VERSION, physics_key(config), load_digest, sun_digest)).encode()).hexdigest()
+
+    def get(self, keys):
+        """
+        Band totals saved for any of the keys, they are marked as just used
+        """
+        found = {}
+        try:
+            db = self.connect()
+            for start in range(0, len(keys), RESULTS_QUERY_SIZE):
+                chunk = keys[start:start + RESULTS_QUERY_SIZE]
+                for key, imports, exports in db.execute("SELECT key, imports, exports FROM results WHERE key IN (%s)" % ", ".join("?" * len(chunk)), chunk):
+                    found[key] = (np.frombuffer(imports), np.frombuffer(exports))
+            if found:
+                now = time.time()
+                db.execute("BEGIN IMMEDIATE")
+                db.executemany("UPDATE results SET used = ? WHERE key = ?", [(now, key) for key in found])
+                db.execute("COMMIT")
+        except sqlite3.Error as e:
+            self.failed(e)
+        return found
+
+    def put(self, results):
+        """
+        Save a dictionary of band totals by key, then drop the least recently used results beyond the limit
+        """
+        if not results:
+            return
+        try:
+            db = self.connect()
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                           [(key, imports.tobytes(), exports.tobytes(), imports.nbytes + exports.nbytes, now) for key, (imports, exports) in results.items()])
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.limit:
+                # Drop down to 90% of the limit so the next few saves don't evict again
+                drop = []
+                for key, size in db.execute("SELECT key, size FROM results ORDER BY used"):
+                    if total <= self.limit * 0.9:
+                        break
+                    drop.append((key,))
+                    total -= size
+                db.executemany("DELETE FROM results WHERE key = ?", drop)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            self.failed(e)
+
+    def failed(self, e):
+        # Carry on without the results saved on disk
+        if self.connection is not None and self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+        print("WARN: Results cache %s is unavailable: %s" % (self.filename, e))
+        self.limit = 0
+
+# Open results caches by file name, most keys looked up in one query
+RESULTS_CACHES = {}
+RESULTS_QUERY_SIZE = 500
+
+def results_cache(config):
+    """
+    The results cache in LOAD_CACHE, None if it is disabled with RESULTS_CACHE_MB 0 or LOAD_CACHE ""
+    """
+    if not config['LOAD_CACHE'] or not config['RESULTS_CACHE_MB']:
+        return None
+    filename = os.path.join(config['LOAD_CACHE'], "results.db")
+    if filename not in RESULTS_CACHES:
+        RESULTS_CACHES[filename] = cl_results(filename, config['RESULTS_CACHE_MB'] * 1024 * 1024)
+    results = RESULTS_CACHES[filename]
+    return results if results.limit else None
+
+def scenario_flows(configs, load, trace=[], cache=None, checkpoint=None):
+    """
+    Simulate each distinct physical configuration once, returns the (import, export) kWh tariff band totals for every config
+    and a dictionary of the hourly traces for the config indexes listed in trace
+    Flows found in the cache dictionary are not simulated again and new flows are added to it
+    Heuristic configs are resumed from the checkpoint when it has them, the rest are added to it
+    Flows are also saved to and found in the results cache on disk when it is enabled
+    """
+    traced = set(physics_key(configs[index]) for index in trace)
+    flows = {}
+    distinct = {}
+    for config in configs:
+        key = physics_key(config)
+        if cache is not None and key in cache and key not in traced:
+            flows[key] = cache[key]
+        else:
+            distinct.setdefault(key, config)
+    table = load.table()
+    for config in distinct.values():
+        if day_slots(config) != table.shape[1]:
+            raise DataError("SLOT_MINUTES %s does not match the %d slots a day of the consumption data" % (config['SLOT_MINUTES'], table.shape[1]))
+
+    # One sun table for each sunrise file and slot length
+    def sun_group(config):
+        return (config['SUNRISE'], config['SLOT_MINUTES'])
+    suns = {}
+    for config in distinct.values():
+        if sun_group(config) not in suns:
+            suns[sun_group(config)] = cl_sun(config['SUNRISE'], slot_minutes=config['SLOT_MINUTES']).table()
+
+    # Results of earlier runs saved on disk
+    results = results_cache(configs[0])
+    saved = {}
+    if results and distinct:
+        load_digest = hashlib.sha256(np.ascontiguousarray(table).tobytes()).hexdigest()
+        sun_digests = dict((group, hashlib.sha256(np.ascontiguousarray(sun).tobytes()).hexdigest()) for group, sun in suns.items())
+        saved = dict((key, results.key(config, load_digest, sun_digests[sun_group(config)])) for key, config in distinct.items())
+        found = results.get(list(saved.values()))
+        for key in list(distinct):
+            if saved[key] in found:
+                flows[key] = found[saved.pop(key)]
+                if cache is not None:
+                    cache[key] = flows[key]
+                if key not in traced:
+                    del distinct[key]
+
+    recording = set()
+    if checkpoint:
+        for key, config in list(distinct.items()):
+            if config['DISPATCH'] != 'heuristic':
+                continue
+            resumed = checkpoint.resume(key, config, suns[sun_group(config)])
+            if resumed is None:
+                recording.add(key)
+                continue
+            flows[key] = resumed
+            if cache is not None:
+                cache[key] = resumed
+            if key not in traced:
+                del distinct[key]
+
+    # Run each group of configs through the engine for its dispatch mode
+    key_traces = {}
+    for dispatch, engine in DISPATCH_ENGINES.items():
+        keys = [key for key, config in distinct.items() if config['DISPATCH'] == dispatch]
+        if keys:
+            engine = scenario_engine(distinct[keys[0]], len(keys))
+        # Each chunk shares one sun table, optimal chunks are also solved at one DISPATCH_STEPS
+        groups = {}
+        for key in keys:
+            config = distinct[key]
+            groups.setdefault((sun_group(config), config['DISPATCH_STEPS'] if dispatch == 'optimal' else None), []).append(key)
+        size = DISPATCH_CHUNK if dispatch == 'optimal' else len(keys)
+        chunks = [group[i:i + size] for group in groups.values() for i in range(0, len(group), size)]
+        for chunk in chunks:
+            sun = suns[sun_group(distinct[chunk[0]])]
+            batch = globals()[engine]([distinct[key] for key in chunk])
+            chunk_traced = [index for index, key in enumerate(chunk) if key in traced or key in recording]
+            batch.run(table, sun, trace=chunk_traced)
+            for index, key in enumerate(chunk):
+                if key not in flows:
+                    flows[key] = batch.flows[index]
+                if cache is not None:
+                    cache[key] = flows[key]
+                if key in traced:
+                    key_traces[key] = batch.trace.scenario(chunk_traced.index(index))
+                if key in recording:
+                    checkpoint.record(key, distinct[key], sun, batch.trace.scenario(chunk_traced.index(index)))
+
+    for key, config in distinct.items():
+        if key not in flows:
+            raise DataError("Unknown DISPATCH mode %s, must be one of %s" % (config['DISPATCH'], ", ".join(DISPATCH_ENGINES)))
+    if results:
+        results.put(dict((saved[key], flows[key]) for key in saved))
+
+    traces = {}
+    for index in trace:
+        traces[index] = key_traces[physics_key(configs[index])]
+    return [flows[physics_key(config)] for config in configs], traces
+
+def trace_names(config, baseline, year=1):
+    """
+    File names for the hourly trace and daily rollup of a scenario
+    """
+    if baseline:
+        name = "data_baseline"
+    else:
+        name = "data_bat%f_sol%f" % (config['BATTERY_SIZE'], config['SOLAR_SIZE'])
+    if year != 1:
+        name += "_year%d" % year
+    return name + ".csv", name + "_daily.csv"
+
+def show_scenario(config, trace, flows):
+    """
+    Show the totals for one year of a traced scenario
+    """
+    print ("---------- BATTERY %f SOLAR %f COST %0.2f--------" % (config['BATTERY_SIZE'], config['SOLAR_SIZE'], config['EQUIPMENT_COST']))
+    print ("Total energy load used %lf kWh" % trace.column('load').sum())
+    print ("Panel size %f produced %f kw\n" % (config['SOLAR_SIZE'], trace.column('solar_produce').sum()))
+
+    level = trace.column('battery_level')
+    change = np.diff(level, prepend=0.0)
+    print ("Battery is at %f kw / %f max" % (level[-1], config['BATTERY_SIZE'] * config['BATTERY_DOD']))
+    print ("Battery incoming energy %f kw outgoing %f kw" % (change[change > 0].sum(), -change[change < 0].sum()))
+
+    # Cheap rate bands are shown as night
+    tariff = get_tariff(config)
+    imports, exports = flows
+    cheap = tariff.import_cheap
+    grid = cl_grid(config)
+    grid.draw_day = float(imports[~cheap].sum())
+    grid.draw_night = float(imports[cheap].sum())
+    grid.draw_feedin = float(exports.sum())
+    grid.total_drawn = grid.draw_day + grid.draw_night
+    grid.cost_day = float(np.dot(imports[~cheap], tariff.import_prices[~cheap]))
+    grid.cost_night = float(np.dot(imports[cheap], tariff.import_prices[cheap]))
+    grid.cost_feedin = float(np.dot(exports, tariff.export_prices))
+    grid.cost = price_flows(flows, config)
+    grid.show()
+
+def price_flows(flows, config):
+    """
+    Grid cost of the energy flows at the tariff in config
+    """
+    return get_tariff(config).price(flows)
+
+def load_data(mode, show=True, config=CONFIG):
+    """
+    Load the consumption data for the given mode (csv|api|profile)
+    """
+    # Octopus data or profiled load?
+    if mode.lower() == 'api':
+        return cl_load(None, show, apimode=True, config=config)
+    elif mode.lower() == 'csv':
+        return cl_load(config['CONSUMPTION'], show, config=config)
+    else:
+        return cl_load(None, show, profile=config['PROFILE'], total=config['ANNUAL_USAGE'], config=config)
+
+def year_configs(config):
+    """
+    Return the configuration for each year of the projection after battery loss, inflation and battery growth
+    """
+    if config['YEARS'] < 1:
+        raise DataError("YEARS must be at least 1")
+    config = dict(config)
+    configs = []
+    year = 0
+    while year < config['YEARS']:
+        configs.append(dict(config))
+        year += 1
+
+        # Annual adjustments
+        config['BATTERY_SIZE'] *= config['ANNUAL_BATTERY_LOSS'] # Loss of battery capacity
+        night_diff = config['PRICE_DAY'] - config['PRICE_NIGHT']
+        config['PRICE_DAY']    *= config['INFLATION'] # Inflation for electric costs
+        config['TARIFF_SCALE'] *= config['INFLATION']
+        if config['PRICE_NIGHT_TRACKS']:
+            config['PRICE_NIGHT'] = config['PRICE_DAY'] - night_diff
+        else:
+            config['PRICE_NIGHT']  *= config['INFLATION'] # Inflation for electric costs
+
+        # Add batteries annually
+        if (config['BATTERY_GROW'] and (config['BATTERY_SIZE'] + config['BATTERY_GROW']) <= config['BATTERY_MAX']):
+            config['BATTERY_SIZE'] += config['BATTERY_GROW']
+            config['EQUIPMENT_COST'] += config['BATTERY_GROW_COST']
+    return configs
+
+def baseline_configs(configs):
+    """
+    The same years with no battery or solar, with nothing to dispatch the heuristic gives the same flows as optimal
+    dispatch and is simulated once rather than for each year's prices
+    """
+    return [dict(config, BATTERY_SIZE=0, SOLAR_SIZE=0, DISPATCH='heuristic') for config in configs]
+
+def price_projection(configs, flows, base_flows, show=True):
+    """
+    Price the energy flows of each year, returns a list of results per year
+    """
+    total_cost = 0
+    base_cost = 0
+    results = []
+
+    for year, config in enumerate(configs, 1):
+        base_cost_year = price_flows(base_flows[year - 1], config)
+        base_cost += base_cost_year
+        annual_cost = price_flows(flows[year - 1], config)
+        total_cost += annual_cost
+
+        results.append({
+            'year' : year,
+            'price_day' : config['PRICE_DAY'],
+            'price_night' : config['PRICE_NIGHT'],
+            'cost' : annual_cost,
+            'total_cost' : total_cost,
+            'base_cost' : base_cost_year,
+            'total_base_cost' : base_cost,
+            'saving' : base_cost_year - annual_cost,
+            'total_saving' : base_cost - total_cost - config['EQUIPMENT_COST'],
+            'equipment_cost' : config['EQUIPMENT_COST']
+        })
+        if show:
+            print("Year %2d - Rates day %0.2f night %0.2f Cost: %0.2f (%0.2f total) Base cost: %0.2f (%0.2f total) Saving %0.2f (total %0.2f)" % (year, config['PRICE_DAY'], config['PRICE_NIGHT'], annual_cost, total_cost, base_cost_year, base_cost, base_cost_year - annual_cost, base_cost - total_cost - config['EQUIPMENT_COST']))
+    return results
+
+def project(load, show=True, config=CONFIG, cache=None):
+    """
+    Project the baseline and the equipment scenario over the years, returns a list of results per year
+    Each distinct physical configuration is simulated once and then priced for every year
+    """
+    configs = year_configs(config)
+    bases = baseline_configs(configs)
+
+    # Hourly traces of the selected years for the equipment and optionally the baseline
+    trace = []
+    if show:
+        for year in config['TRACE_YEARS']:
+            if 1 <= year <= len(configs):
+                trace.append(int(year) - 1)
+                if config['TRACE_BASELINE']:
+                    trace.append(len(configs) + int(year) - 1)
+    checkpoint = load_checkpoint(load, config)
+    flows, traces = scenario_flows(configs + bases, load, trace, cache, checkpoint)
+    if checkpoint:
+        checkpoint.save()
+        if show:
+            checkpoint.show()
+
+    for index in trace:
+        baseline = index >= len(configs)
+        year = index - len(configs) + 1 if baseline else index + 1
+        year_config = bases[year - 1] if baseline else configs[year - 1]
+        traces[index].save(*trace_names(year_config, baseline, year), format=config['TRACE_FORMAT'])
+        if not baseline and year == 1:
+            show_scenario(year_config, traces[index], flows[index])
+
+    return price_projection(configs, flows[:len(configs)], flows[len(configs):], show)
+
+def summarise(results):
+    """
+    Summarise a projection into total cost, savings and the payback year (None if it never pays back)
+    """
+    payback = None
+    for result in results:
+        if result['total_saving'] >= 0:
+            payback = result['year']
+            break
+    last = results[-1]
+    return {
+        'total_cost' : last['total_cost'],
+        'total_base_cost' : last['total_base_cost'],
+        'saving' : last['total_base_cost'] - last['total_cost'],
+        'net_saving' : last['total_saving'],
+        'equipment_cost' : last['equipment_cost'],
+        'payback_year' : payback
+    }
+
+def simulate(mode, config=CONFIG):
+    load = load_data(mode, config=config)
+    return project(load, config=config)
+
+def config_value(item, value):
+    """
+    Convert a command line string into the type of the CONFIG item
+    """
+    if isinstance(CONFIG[item], bool):
+        return value.lower() not in ('false', '0', 'no', 'off')
+    elif isinstance(CONFIG[item], list):
+        return yaml.safe_load(value)
+    elif isinstance(CONFIG[item], (int, float)):
+        return float(value)
+    else:
+        return value
+
+# CONFIG items the consumption data was loaded with, a sweep or quote can not change them
+LOAD_KEYS = ['CONSUMPTION', 'PROFILE', 'PROFILE_BACKFILL', 'BACKFILL_METHOD', 'ANNUAL_USAGE', 'SLOT_MINUTES']
+
+def parse_sweep(spec):
+    """
+    Parse a sweep spec of KEY=a,b,c (list) or KEY=start:stop[:step] (inclusive range)
+    """
+    if '=' not in spec:
+        raise ValueError("sweep %s must be KEY=values" % spec)
+    item, values = spec.split('=', 1)
+    if item not in CONFIG:
+        raise ValueError("sweep option %s does not exist" % item)
+    if item in LOAD_KEYS:
+        raise ValueError("sweep option %s can not be swept as the consumption data is loaded once, run each value separately" % item)
+    if ':' in values:
+        parts = [float(part) for part in values.split(':')]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else 1.0
+        if step <= 0:
+            raise ValueError("sweep %s step must be positive" % item)
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return item, [round(start + step * i, 10) for i in range(count)]
+    return item, [config_value(item, value) for value in values.split(',')]
+
+# Per process state for the sweep worker pool
+SWEEP_LOAD = None
+SWEEP_CONFIG = None
+
+# Most combinations handed to a worker at once
+SWEEP_CHUNK = 64
+
+def sweep_init(load, config):
+    global SWEEP_LOAD, SWEEP_CONFIG
+    SWEEP_LOAD = load
+    SWEEP_CONFIG = config
+
+def sweep_run(combinations):
+    """
+    Run a chunk of sweep combinations, all of their years are simulated together in one batch
+    """
+    projections = [year_configs(dict(SWEEP_CONFIG, **combination)) for combination in combinations]
+    configs = []
+    for years in projections:
+        configs += years + baseline_configs(years)
+    flows, traces = scenario_flows(configs, SWEEP_LOAD)
+
+    rows = []
+    offset = 0
+    for combination, years in zip(combinations, projections):
+        count = len(years)
+        row = dict(combination)
+        row.update(summarise(price_projection(years, flows[offset:offset + count], flows[offset + count:offset + count * 2], show=False)))
+        rows.append(row)
+        offset += count * 2
+    return rows
+
+def sweep(load, sweeps, filename, workers=None):
+    """
+    Run the projection for every combination of the swept CONFIG values across a process pool
+    The load data is loaded once and shared with each worker when the pool starts
+    """
+    keys = [item for item, values in sweeps]
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*[values for item, values in sweeps])]
+    columns = keys + ['total_cost', 'total_base_cost', 'saving', 'net_saving', 'equipment_cost', 'payback_year']
+    print("Sweeping %d combinations of %s" % (len(combinations), ", ".join(keys)))
+
+    # Split into chunks so each worker batches many scenarios per pass through the year
+    workers = workers or multiprocessing.cpu_count()
+    size = max(1, min(SWEEP_CHUNK, int(math.ceil(len(combinations) / float(workers)))))
+    chunks = [combinations[i:i + size] for i in range(0, len(combinations), size)]
+
+    rows = []
+    with multiprocessing.Pool(workers, initializer=sweep_init, initargs=(load, dict(CONFIG))) as pool, open(filename, 'w') as han:
+        han.write(", ".join(columns) + "\n")
+        for chunk in pool.imap(sweep_run, chunks):
+            for row in chunk:
+                han.write(", ".join(str(row[column]) for column in columns) + "\n")
+                rows.append(row)
+
+    print(" ".join("%16s" % column for column in columns))
+    for row in rows:
+        print(" ".join("%16s" % (("%0.2f" % row[column]) if isinstance(row[column], float) else row[column]) for column in columns))
+    print("Sweep results written to %s" % filename)
+    return rows
+
+# Objectives the optimizer can search for
+OPTIMIZE_OBJECTIVES = ['net_saving', 'npv', 'payback_year']
+
+# Sizes searched by the optimizer, the CONFIG item of each size and of its (low, high) bounds
+OPTIMIZE_SIZES = [('BATTERY_SIZE', 'OPTIMIZE_BATTERY'), ('SOLAR_SIZE', 'OPTIMIZE_SOLAR'), ('BATTERY_GROW', 'OPTIMIZE_GROW')]
+
+GOLDEN = (math.sqrt(5.0) - 1.0) / 2.0
+
+def npv(results, rate):
+    """
+    Net present value of a projection, savings are discounted from the end of each year and equipment from the start
+    """
+    value = 0.0
+    bought = 0.0
+    for result in results:
+        discount = (1.0 + rate) ** (result['year'] - 1)
+        value += result['saving'] / (discount * (1.0 + rate))
+        value -= (result['equipment_cost'] - bought) / discount
+        bought = result['equipment_cost']
+    return value
+
+def golden_search(score, lo, hi):
+    """
+    Index from lo to hi with the highest score, assuming the score rises to a single peak and then falls
+    Each step drops the part of the range beyond the worse of two points placed at the golden ratio
+    """
+    while hi - lo > 2:
+        a = lo + int(round((hi - lo) * (1.0 - GOLDEN)))
+        b = max(lo + int(round((hi - lo) * GOLDEN)), a + 1)
+        if score(a) < score(b):
+            lo = a + 1
+        else:
+            hi = b
+    return max(range(lo, hi + 1), key=score)
+
+class cl_optimizer:
+    """ Search for the battery and solar sizes with the best objective, one size at a time with a golden section search """
+    def __init__(self, load, config):
+        self.load = load
+        self.config = config
+        self.objective = config['OPTIMIZE_OBJECTIVE']
+        self.step = float(config['OPTIMIZE_STEP'])
+        self.memo = {}
+        self.rows = []
+
+        # Flows of the baseline and of sizes seen before are shared between evaluations
+        self.cache = {}
+
+        # Sizes searched and the number of steps across their bounds, a size with equal bounds is fixed at that value
+        # and one with no bounds stays at its configured value
+        self.sizes = []
+        self.steps = []
+        self.fixed = {}
+        for item, bounds in OPTIMIZE_SIZES:
+            if not config[bounds]:
+                continue
+            if len(config[bounds]) != 2 or float(config[bounds][0]) > float(config[bounds][1]):
+                raise DataError("%s must be [low, high] bounds, not %s" % (bounds, config[bounds]))
+            low, high = [float(bound) for bound in config[bounds]]
+            steps = max(0, int(round((high - low) / self.step)))
+            if steps:
+                self.sizes.append((item, low))
+                self.steps.append(steps)
+            else:
+                self.fixed[item] = low
+
+    def value(self, dim, index):
+        return round(self.sizes[dim][1] + index * self.step, 6)
+
+    def evaluate(self, point):
+        """
+        Project one set of sizes, memoized, returns its score where higher is better
+        The battery and solar are priced per kWh and kWp on top of EQUIPMENT_COST
+        """
+        point = tuple(point)
+        if point not in self.memo:
+            sizes = dict((item, float(self.config[item])) for item, bounds in OPTIMIZE_SIZES)
+            sizes.update(self.fixed)
+            sizes.update((item, self.value(dim, index)) for dim, ((item, low), index) in enumerate(zip(self.sizes, point)))
+            config = dict(self.config, **sizes)
+            config['EQUIPMENT_COST'] = (self.config['EQUIPMENT_COST'] + sizes['BATTERY_SIZE'] * self.config['BATTERY_COST'] +
+                                        sizes['SOLAR_SIZE'] * self.config['SOLAR_COST'])
+            results = project(self.load, show=False, config=config, cache=self.cache)
+            row = dict(sizes, **summarise(results))
+            row['npv'] = npv(results, self.config['DISCOUNT_RATE'])
+            self.rows.append(row)
+
+            # Paying back sooner is better, ties and never paying back go to the higher net saving
+            if self.objective == 'payback_year':
+                payback = row['payback_year'] if row['payback_year'] is not None else self.config['YEARS'] + 1
+                self.memo[point] = (-payback, row['net_saving'])
+            else:
+                self.memo[point] = row[self.objective]
+        return self.memo[point]
+
+    def search(self, rounds=2):
+        """
+        Coordinate descent from the configured sizes, returns the best point found
+        A golden section search along each size finds the peak, then a pattern search that also moves diagonally
+        follows the ridge where a bigger battery pays off with more solar
+        """
+        point = []
+        for dim, (item, low) in enumerate(self.sizes):
+            point.append(min(max(0, int(round((float(self.config[item]) - low) / self.step))), self.steps[dim]))
+        for count in range(rounds):
+            moved = False
+            for dim in range(len(point)):
+                best = golden_search(lambda index: self.evaluate(point[:dim] + [index] + point[dim + 1:]), 0, self.steps[dim])
+                if best != point[dim]:
+                    point[dim] = best
+                    moved = True
+            if not moved:
+                break
+
+        # Pattern search from strides of a quarter of the range down to one step
+        stride = max(1, max(self.steps, default=0) // 4)
+        while stride:
+            moves = [move for move in itertools.product([-stride, 0, stride], repeat=len(point)) if any(move)]
+            neighbours = [[index + offset for index, offset in zip(point, move)] for move in moves]
+            neighbours = [neighbour for neighbour in neighbours if all(0 <= index <= steps for index, steps in zip(neighbour, self.steps))]
+            best = max(neighbours, key=self.evaluate, default=point)
+            if self.evaluate(best) > self.evaluate(point):
+                point = best
+            else:
+                stride //= 2
+        return point
+
+def optimize(load, filename):
+    """
+    Search the BATTERY_SIZE, SOLAR_SIZE and BATTERY_GROW bounds for the best OPTIMIZE_OBJECTIVE
+    Every projection evaluated is written to filename
+    """
+    if CONFIG['OPTIMIZE_OBJECTIVE'] not in OPTIMIZE_OBJECTIVES:
+        raise DataError("Unknown OPTIMIZE_OBJECTIVE %s, must be one of %s" % (CONFIG['OPTIMIZE_OBJECTIVE'], ", ".join(OPTIMIZE_OBJECTIVES)))
+    optimizer = cl_optimizer(load, dict(CONFIG))
+    searched = dict(optimizer.sizes)
+    searched = ["%s %s to %s" % (item, CONFIG[bounds][0], CONFIG[bounds][1]) for item, bounds in OPTIMIZE_SIZES if item in searched]
+    fixed = "".join(", %s fixed at %g" % (item, value) for item, value in optimizer.fixed.items())
+    print("Optimizing %s over %s in steps of %s%s" % (CONFIG['OPTIMIZE_OBJECTIVE'], ", ".join(searched) or "no sizes", optimizer.step, fixed))
+
+    point = optimizer.search()
+    best = optimizer.rows[list(optimizer.memo).index(tuple(point))]
+    columns = [item for item, bounds in OPTIMIZE_SIZES] + ['equipment_cost', 'total_cost', 'total_base_cost', 'saving', 'net_saving', 'npv', 'payback_year']
+    with open(filename, 'w') as han:
+        han.write(", ".join(columns) + "\n")
+        for row in optimizer.rows:
+            han.write(", ".join(str(row[column]) for column in columns) + "\n")
+
+    grid = 1
+    for steps in optimizer.steps:
+        grid *= steps + 1
+    print(" ".join("%16s" % column for column in columns))
+    print(" ".join("%16s" % (("%0.2f" % best[column]) if isinstance(best[column], float) else best[column]) for column in columns))
+    print("Best %s found after %d evaluations, a grid would take %d" % (CONFIG['OPTIMIZE_OBJECTIVE'], len(optimizer.rows), grid))
+    print("Optimizer results written to %s" % filename)
+    return best
+
+# Ensemble members run through the engine at once, bounds the memory used for their sun tables
+ENSEMBLE_CHUNK = 250
+
+def weather_factors(rng, members, days, variation, correlation):
+    """
+    Daily cloudiness factors with a mean of 1 that scale the average sun hours, returns a members x days array
+    Each day is correlated with the day before so cloudy and sunny spells last more than a day
+    """
+    noise = rng.standard_normal((days, members))
+    state = np.empty((days, members))
+    state[0] = noise[0]
+    spread = math.sqrt(1.0 - correlation * correlation)
+    for day in range(1, days):
+        state[day] = correlation * state[day - 1] + spread * noise[day]
+    return np.exp(variation * state - variation * variation / 2.0).T
+
+def ensemble_run(task):
+    """
+    Run every ensemble member through one year of the projection, returns the annual cost of each member
+    """
+    config, factors = task
+    engine = scenario_engine(config, min(len(factors), ENSEMBLE_CHUNK))
+    table = SWEEP_LOAD.table()
+    sun = cl_sun(config['SUNRISE'], slot_minutes=config['SLOT_MINUTES']).table()
+    size = DISPATCH_CHUNK if engine == 'cl_dispatch' else ENSEMBLE_CHUNK
+    costs = np.zeros(len(factors))
+    for start in range(0, len(factors), size):
+        chunk = factors[start:start + size]
+        batch = globals()[engine]([config] * len(chunk))
+        costs[start:start + len(chunk)] = batch.run(table, sun[None, :, :] * chunk[:, :, None])
+    return costs
+
+def percentiles(values, lower_is_better=False):
+    """
+    P10, P50 and P90 of the member values, P90 is the pessimistic value that 90% of members do at least as well as
+    """
+    values = np.sort(values)
+    if not lower_is_better:
+        values = values[::-1]
+    return [values[min(len(values) - 1, int(round(p * (len(values) - 1))))] for p in (0.1, 0.5, 0.9)]
+
+def ensemble(load, members, filename, workers=None):
+    """
+    Run the projection for a weather ensemble, each year of each member has its own seeded daily cloudiness around
+    the monthly sun hours. The members of each year are run in batches, the years across a process pool
+    Writes the results of each member to filename and returns them
+    """
+    configs = year_configs(CONFIG)
+    if not scenario_engine(CONFIG):
+        raise DataError("Unknown DISPATCH mode %s, must be one of %s" % (CONFIG['DISPATCH'], ", ".join(DISPATCH_ENGINES)))
+    print("Running a %d member weather ensemble over %d years" % (members, len(configs)))
+
+    # The baseline has no solar so the weather does not change it
+    bases = baseline_configs(configs)
+    base_flows, traces = scenario_flows(bases, load)
+    base_costs = np.array([price_flows(flows, config) for flows, config in zip(base_flows, bases)])
+
+    # Weather is drawn up front so the results do not depend on the number of workers
+    rng = np.random.default_rng(CONFIG['ENSEMBLE_SEED'])
+    days = cl_sun(CONFIG['SUNRISE']).table().shape[0]
+    tasks = [(config, weather_factors(rng, members, days, CONFIG['ENSEMBLE_VARIATION'], CONFIG['ENSEMBLE_CORRELATION'])) for config in configs]
+    workers = min(workers or multiprocessing.cpu_count(), len(tasks))
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=sweep_init, initargs=(load, dict(CONFIG))) as pool:
+            costs = np.stack(pool.map(ensemble_run, tasks), axis=1)
+    else:
+        sweep_init(load, dict(CONFIG))
+        costs = np.stack([ensemble_run(task) for task in tasks], axis=1)
+
+    # Cumulative savings less the equipment cost for each member and year
+    equipment = np.array([config['EQUIPMENT_COST'] for config in configs])
+    total_saving = np.cumsum(base_costs[None, :] - costs, axis=1) - equipment[None, :]
+    paid = total_saving >= 0
+
+    columns = ['member', 'total_cost', 'total_base_cost', 'saving', 'net_saving', 'equipment_cost', 'payback_year']
+    rows = []
+    for member in range(members):
+        rows.append({
+            'member' : member + 1,
+            'total_cost' : float(costs[member].sum()),
+            'total_base_cost' : float(base_costs.sum()),
+            'saving' : float(base_costs.sum() - costs[member].sum()),
+            'net_saving' : float(total_saving[member, -1]),
+            'equipment_cost' : equipment[-1],
+            'payback_year' : int(paid[member].argmax()) + 1 if paid[member].any() else None
+        })
+    with open(filename, 'w') as han:
+        han.write(", ".join(columns) + "\n")
+        for row in rows:
+            han.write(", ".join(str(row[column]) for column in columns) + "\n")
+
+    # Never paying back is worse than any payback year
+    payback = np.array([row['payback_year'] or np.inf for row in rows])
+    print("%16s %16s %16s %16s" % ('', 'P10', 'P50', 'P90'))
+    for name in ['total_cost', 'saving', 'net_saving']:
+        values = np.array([row[name] for row in rows])
+        print("%16s %s" % (name, " ".join("%16.2f" % value for value in percentiles(values, name == 'total_cost'))))
+    print("%16s %s" % ('payback_year', " ".join("%16s" % (int(value) if value != np.inf else None) for value in percentiles(payback, True))))
+    print("Ensemble results written to %s" % filename)
+    return rows
+
+def portfolio_households(source):
+    """
+    Yields the (name, CONFIG overrides) of each household from a directory of consumption CSVs or a YAML manifest
+    Each manifest entry is a dictionary of CONFIG overrides with CONSUMPTION giving the household's CSV (relative
+    to the manifest) and an optional NAME
+    """
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith('.csv'):
+                yield name, {'CONSUMPTION' : os.path.join(source, name)}
+        return
+
+    with open(source, 'r') as han:
+        entries = yaml.safe_load(han) or []
+    base = os.path.dirname(os.path.abspath(source))
+    for index, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            yield "household%d" % index, None
+            continue
+        overrides = dict(entry)
+        if 'CONSUMPTION' in overrides:
+            overrides['CONSUMPTION'] = os.path.join(base, overrides['CONSUMPTION'])
+        yield str(overrides.pop('NAME', None) or os.path.basename(overrides.get('CONSUMPTION', "household%d" % index))), overrides
+
+def portfolio_run(household):
+    """
+    Load and project one household, returns its summary row or the error that stopped it
+    Anything the model prints is kept off the console, the last ERROR line is used when it gives up
+    """
+    name, overrides = household
+    row = {'household' : name}
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            if not isinstance(overrides, dict):
+                raise DataError("Manifest entry is not a dictionary of CONFIG overrides")
+            for item in overrides:
+                if item not in SWEEP_CONFIG:
+                    raise DataError("Bad configuration option %s does not exist" % item)
+            config = dict(SWEEP_CONFIG, **overrides)
+            load = cl_load(config['CONSUMPTION'], False, config=config)
+            row.update(summarise(project(load, show=False, config=config)))
+    except Exception as e:
+        # One bad household must not stop the rest
+        if isinstance(e, DataError):
+            error = str(e)
+        else:
+            error = "%s: %s" % (type(e).__name__, e)
+        # Keep the table one household per line and column
+        row['error'] = error.replace(',', ';').replace('\n', ' ')
+    return row
+
+def portfolio(source, filename, workers=None):
+    """
+    Project every household of a portfolio across a process pool, each worker holds one household at a time
+    Rows are written to filename as each household finishes, returns the number of households that failed
+    """
+    columns = ['household', 'total_cost', 'total_base_cost', 'saving', 'net_saving', 'equipment_cost', 'payback_year', 'error']
+    households = portfolio_households(source)
+    workers = workers or multiprocessing.cpu_count()
+    count = 0
+    failed = 0
+    with open(filename, 'w') as han:
+        han.write(", ".join(columns) + "\n")
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=sweep_init, initargs=(None, dict(CONFIG)))
+            rows = pool.imap_unordered(portfolio_run, households)
+        else:
+            pool = None
+            sweep_init(None, dict(CONFIG))
+            rows = map(portfolio_run, households)
+
+        try:
+            for row in rows:
+                count += 1
+                if 'error' in row:
+                    failed += 1
+                    print("ERROR: Household %s failed: %s" % (row['household'], row['error']))
+                han.write(", ".join(str(row.get(column, '')) for column in columns) + "\n")
+                han.flush()
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    print("Portfolio of %d households, %d failed, results written to %s" % (count, failed, filename))
+    return failed
+
+# Days of the timeline given to the kernel at once, bounds the memory used however long the history is
+TIMELINE_CHUNK = 31
+
+def model_day(date):
+    """
+    Row of the 365 day sun and tariff tables for a date, 29 February uses the row of 28 February
+    """
+    day = date.timetuple().tm_yday
+    if day > 59 and date.year % 4 == 0 and (date.year % 100 != 0 or date.year % 400 == 0):
+        day -= 1
+    return day - 1
+
+def add_years(date, years):
+    """
+    The same date years later, 29 February moves to 28 February outside leap years
+    """
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return date.replace(year=date.year + years, day=28)
+
+def timeline_days(intervals, slots):
+    """
+    Group (date, start slot, end slot, consumption, offset) intervals in date order into (date, energy, present) for
+    every day from the first to the last, days without any data have nothing present. Only the current day is held
+    Intervals are added into slots the same way as cl_load.accumulate(). When the clocks go forward the local hour
+    skipped never exists, slots the offset jumps over are filled from the slot before them
+    """
+    current = None
+    offset = None
+    for date, start, end, consumption, interval_offset in intervals:
+        if date != current:
+            if current is not None:
+                if date < current:
+                    raise DataError("Consumption data is not in date order, %s follows %s" % (date, current))
+                yield day, np.array(energy), np.array(present)
+            following = datetime.strptime(date, '%Y-%m-%d').date()
+            if current is not None:
+                day += timedelta(days=1)
+                while day < following:
+                    yield day, np.zeros(slots), np.zeros(slots, dtype=bool)
+                    day += timedelta(days=1)
+            current = date
+            day = following
+            energy = [0.0] * slots
+            present = [False] * slots
+            last_slot = -1
+            last_end = None
+
+        if interval_offset != offset:
+            fill_skipped(energy, present, offset, interval_offset, last_end, start)
+            offset = interval_offset
+
+        slots_covered = end - start
+        if slots_covered == 0:
+            slots_covered = 1
+        elif slots_covered < 0:
+            # Ends at or after midnight, the rest of the day is covered
+            slots_covered = slots - start
+        for slot in range(start, start + slots_covered):
+            if not present[slot]:
+                energy[slot] = consumption / slots_covered
+                present[slot] = True
+            elif last_slot == start:
+                energy[slot] += consumption / slots_covered
+            else:
+                energy[slot] = consumption / slots_covered
+            last_slot = start
+        last_end = start + slots_covered
+
+    if current is not None:
+        yield day, np.array(energy), np.array(present)
+
+def timeline_series(load, filename, years):
+    """
+    The consumption of every day for years from the first day of filename as (date, energy, filled) in date order,
+    filled is the number of missing slots filled in or None for days projected beyond the end of the data
+    Missing slots are filled from the same day of the latest year (at first the validated year of load) when
+    PROFILE_BACKFILL is set, and after the data ends the latest year repeats
+    """
+    latest = np.array(load.table())
+    date = None
+    end = None
+    for date, energy, present in timeline_days(load.read_intervals(filename, offsets=True), load.slots):
+        if end is None:
+            end = add_years(date, years)
+        if date >= end:
+            return
+        row = model_day(date)
+        filled = int(load.slots - present.sum())
+        if filled:
+            if not load.config['PROFILE_BACKFILL']:
+                raise DataError("Input data is incomplete for %s hour %d" % (date, np.flatnonzero(~present)[0] * 24 // load.slots))
+            energy = np.where(present, energy, latest[row])
+        if date.month != 2 or date.day != 29:
+            latest[row] = energy
+        yield date, energy, filled
+
+    if date is None:
+        raise DataError("No consumption data in %s" % filename)
+    date += timedelta(days=1)
+    while date < end:
+        yield date, latest[model_day(date)], None
+        date += timedelta(days=1)
+
+def timeline_blocks(series, chunk=TIMELINE_CHUNK):
+    """
+    Group the days of series into (year, dates, energy, filled) blocks of up to chunk days, the year counts from 0 at
+    the first day and a block never crosses its anniversary
+    """
+    first = None
+    year = 0
+    dates = []
+    for date, energy, filled in series:
+        if first is None:
+            first = date
+            boundary = add_years(first, 1)
+            rows = np.zeros((chunk, len(energy)))
+            fills = []
+        while date >= boundary:
+            if dates:
+                yield year, dates, rows[:len(dates)], fills
+                dates = []
+                fills = []
+            year += 1
+            boundary = add_years(first, year + 1)
+        rows[len(dates)] = energy
+        dates.append(date)
+        fills.append(filled)
+        if len(dates) == chunk:
+            yield year, dates, rows, fills
+            dates = []
+            fills = []
+    if dates:
+        yield year, dates, rows[:len(dates)], fills
+
+class cl_timeline:
+    """
+    One scenario stepped through the timeline a block of days at a time with scenario_kernel, the battery state
+    carries on from block to block and across years. The flows of each year are totalled into its tariff bands
+    """
+    def __init__(self, configs, sun):
+        self.configs = configs
+        self.sun = sun
+        self.state = kernel_state(configs[0])
+        self.flows = []
+
+    def run(self, year, rows, load):
+        """
+        Step through the days of year given by rows of the sun and tariff tables with a days x slots load
+        """
+        config = self.configs[year]
+        tariff = get_tariff(config)
+        slots = load.shape[1]
+        if year == len(self.flows):
+            # The battery may have lost or gained capacity, the target follows it unless it is dynamic
+            bmax = float(config['BATTERY_SIZE'] * config['BATTERY_DOD'])
+            self.state[0] = min(self.state[0], bmax)
+            self.state[1] = min(self.state[1], bmax) if config['DYNAMIC_CHARGE'] else bmax
+            self.flows.append((np.zeros(len(tariff.import_prices)), np.zeros(len(tariff.export_prices))))
+        imports, exports = self.flows[year]
+
+        hours = load.size
+        solar = (config['SOLAR_SIZE'] * self.sun[rows].reshape(-1)) * (0.627 * config['SOLAR_YIELD'])
+        scenario_kernel(solar - load.reshape(-1), *kernel_args(config, tariff, slots, rows), np.zeros(hours, dtype=np.int8),
+                        np.zeros((len(KERNEL_COLUMNS), hours)), imports, exports, 0, -1, np.zeros((hours // slots + 1, 3)), self.state, slots)
+
+def timeline(load, filename):
+    """
+    Replay the consumption history of load day by day in date order, with the battery carried on from one day and year
+    to the next, then carry on to YEARS by repeating the latest year of the history. Each year is priced as in project()
+    Only a block of days is held in memory at once, the results per year are written to filename
+    """
+    if not load.source:
+        raise DataError("Timeline replay needs csv or api consumption data")
+    if CONFIG['DISPATCH'] != 'heuristic':
+        raise DataError("Timeline replay needs DISPATCH: heuristic, optimal dispatch plans a whole year at once")
+
+    configs = year_configs(CONFIG)
+    sun = cl_sun(CONFIG['SUNRISE'], slot_minutes=CONFIG['SLOT_MINUTES']).table()
+    equipment = cl_timeline(configs, sun)
+    baseline = cl_timeline(baseline_configs(configs), sun)
+    years = []
+    for year, dates, energy, fills in timeline_blocks(timeline_series(load, load.source, len(configs))):
+        rows = np.array([model_day(date) for date in dates])
+        equipment.run(year, rows, energy)
+        baseline.run(year, rows, energy)
+        if year == len(years):
+            years.append({'start' : dates[0], 'days' : 0, 'history_days' : 0, 'filled' : 0})
+        years[year]['days'] += len(dates)
+        years[year]['history_days'] += sum(1 for filled in fills if filled is not None)
+        years[year]['filled'] += sum(filled for filled in fills if filled)
+
+    results = price_projection(configs, equipment.flows, baseline.flows)
+    history = sum(row['history_days'] for row in years)
+    filled = sum(row['filled'] for row in years)
+    if filled:
+        print("WARN: Input data is incomplete, filled %g hours of the timeline from the same day of the latest year" % (filled * 24.0 / load.slots))
+    print("Replayed %d days of consumption from %s, projected %d days after it" % (history, years[0]['start'], sum(row['days'] for row in years) - history))
+
+    columns = ['year', 'start', 'days', 'history_days', 'price_day', 'price_night', 'cost', 'base_cost', 'saving', 'total_saving']
+    with open(filename, 'w') as han:
+        han.write(", ".join(columns) + "\n")
+        for result, row in zip(results, years):
+            result.update(row)
+            han.write(", ".join(str(result[column]) for column in columns) + "\n")
+    print("Timeline results written to %s" % filename)
+    return results
+
+# Most scenario flows the quote service keeps warm before starting again
+SERVE_CACHE_SIZE = 4096
+
+def quote(load, request, cache):
+    """
+    Answer one quote request {"config": {CONFIG overrides}} against the loaded consumption data
+    Returns the results per year and their summary, raises ValueError or DataError for a bad request
+    """
+    overrides = request.get('config', {})
+    if not isinstance(overrides, dict):
+        raise ValueError("config must be an object of CONFIG overrides")
+    for item in overrides:
+        if item not in CONFIG:
+            raise ValueError("Bad configuration option %s does not exist" % item)
+        if item in LOAD_KEYS:
+            raise ValueError("%s can not be changed as the consumption data is already loaded" % item)
+    config = dict(CONFIG, **overrides)
+    if not scenario_engine(config):
+        raise ValueError("Unknown DISPATCH mode %s, must be one of %s" % (config['DISPATCH'], ", ".join(DISPATCH_ENGINES)))
+
+    if len(cache) > SERVE_CACHE_SIZE:
+        cache.clear()
+    results = project(load, show=False, config=config, cache=cache)
+    return {'years' : results, 'summary' : summarise(results)}
+
+def serve_request(load, line, cache):
+    """
+    Answer one JSON request, the reply echoes the request id and has either the quote or an error
+    """
+    start = time.perf_counter()
+    reply = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        reply['id'] = request.get('id')
+        # Keep anything the model prints off the reply stream
+        with contextlib.redirect_stdout(sys.stderr):
+            reply.update(quote(load, request, cache))
+    except Exception as e:
+        # A bad request must never stop the service
+        reply['error'] = str(e) if isinstance(e, (ValueError, DataError)) else "%s: %s" % (type(e).__name__, e)
+    reply['seconds'] = time.perf_counter() - start
+    return json.dumps(reply)
+
+def serve(load, port=None):
+    """
+    Answer quote requests against the loaded consumption data, the load, sun table and simulated flows stay warm
+    Reads one JSON request per line from stdin and writes one JSON reply per line to stdout until stdin closes
+    or with a port answers POST requests on localhost
+    """
+    # Answer the configured scenario first so the first real request is not slowed by warming up
+    cache = {}
+    with contextlib.redirect_stdout(sys.stderr):
+        quote(load, {}, cache)
+
+    if port:
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = serve_request(load, self.rfile.read(length), cache).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', port), handler)
+        print("Serving quotes on http://127.0.0.1:%d/" % port, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return
+
+    print("Serving quotes on stdin", file=sys.stderr)
+    for line in sys.stdin:
+        if line.strip():
+            print(serve_request(load, line, cache), flush=True)
+
+class cl_profiler:
+    """ Stage timings and hot path counts, installed by wrapping functions so it costs nothing when not used """
+
+    # Functions and methods timed as stages of a run
+    STAGES = [
+        ('load_csv', 'cl_load', 'load_csv'),
+        ('load_api', 'cl_load', 'load_api'),
+        ('process_results', 'cl_load', 'process_results'),
+        ('ingest', 'cl_load', 'accumulate'),
+        ('snapshot_load', 'cl_load', 'load_snapshot'),
+        ('validate_data', 'cl_load', 'validate_data'),
+        ('sun_table', None, 'sun_table'),
+        ('cl_sun', 'cl_sun', '__init__'),
+        ('hourly_loop_batch', 'cl_batch', 'run'),
+        ('hourly_loop_kernel', 'cl_kernel', 'run'),
+        ('hourly_loop_dispatch', 'cl_dispatch', 'run'),
+        ('hourly_loop_timeline', 'cl_timeline', 'run'),
+        ('hourly_loop_python', None, 'run_scenario'),
+        ('trace_save', 'cl_trace', 'save'),
+        ('project', None, 'project')
+    ]
+
+    # Hot path work that is only counted, with the amount each call adds from its arguments and result
+    COUNTS = [
+        ('scenarios_batch', 'cl_batch', 'run', lambda args, result: args[0].count),
+        ('slots_batch', 'cl_batch', 'run', lambda args, result: args[0].count * args[1].size),
+        ('scenarios_kernel', 'cl_kernel', 'run', lambda args, result: args[0].count),
+        ('slots_kernel', 'cl_kernel', 'run', lambda args, result: args[0].count * args[1].size),
+        ('scenarios_dispatch', 'cl_dispatch', 'run', lambda args, result: args[0].count),
+        ('slots_dispatch', 'cl_dispatch', 'run', lambda args, result: args[0].count * args[1].size),
+        ('slots_timeline', 'cl_timeline', 'run', lambda args, result: args[3].size),
+        ('results_cache_hits', 'cl_results', 'get', lambda args, result: len(result)),
+        ('results_cache_misses', 'cl_results', 'get', lambda args, result: len(args[1]) - len(result)),
+        ('checkpoint_hits', 'cl_checkpoint', 'resume', lambda args, result: result is not None),
+        ('checkpoint_misses', 'cl_checkpoint', 'resume', lambda args, result: result is None)
+    ]
+
+    # The simulation loop is what is run under cProfile
+    LOOPS = ['hourly_loop_batch', 'hourly_loop_kernel', 'hourly_loop_dispatch', 'hourly_loop_timeline', 'hourly_loop_python']
+
+    def __init__(self, cprofile=None):
+        self.stages = {}
+        self.counts = {}
+        self.originals = []
+        self.start = time.perf_counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.cprofile_file = cprofile
+
+    def replace(self, owner, attr, wrapper):
+        target = globals()[owner] if owner else None
+        original = getattr(target, attr) if target else globals()[attr]
+        self.originals.append((target, attr, original))
+        if target:
+            setattr(target, attr, wrapper(original))
+        else:
+            globals()[attr] = wrapper(original)
+
+    def timed(self, name):
+        stage = self.stages.setdefault(name, {'calls' : 0, 'seconds' : 0.0})
+        cprofile = self.cprofile if name in self.LOOPS else None
+        def wrapper(func):
+            @functools.wraps(func)
+            def timed_func(*args, **kwargs):
+                stage['calls'] += 1
+                if cprofile:
+                    cprofile.enable()
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stage['seconds'] += time.perf_counter() - start
+                    if cprofile:
+                        cprofile.disable()
+            return timed_func
+        return wrapper
+
+    def counted(self, name, amount):
+        self.counts[name] = 0
+        counts = self.counts
+        def wrapper(func):
+            @functools.wraps(func)
+            def counted_func(*args, **kwargs):
+                result = func(*args, **kwargs)
+                counts[name] += int(amount(args, result))
+                return result
+            return counted_func
+        return wrapper
+
+    def install(self):
+        for name, owner, attr in self.STAGES:
+            self.replace(owner, attr, self.timed(name))
+        for name, owner, attr, amount in self.COUNTS:
+            self.replace(owner, attr, self.counted(name, amount))
+
+    def uninstall(self):
+        for target, attr, original in reversed(self.originals):
+            if target:
+                setattr(target, attr, original)
+            else:
+                globals()[attr] = original
+        self.originals = []
+
+    def report(self, filename, extra={}):
+        """
+        Write the JSON report and the cProfile dump of the simulation loop
+        """
+        report = dict(extra)
+        report['total_seconds'] = time.perf_counter() - self.start
+        report['stages'] = self.stages
+        report['counts'] = self.counts
+        with open(filename, 'w') as han:
+            json.dump(report, han, indent=2)
+        print("Profile report written to %s" % filename)
+        if self.cprofile:
+            self.cprofile.dump_stats(self.cprofile_file)
+            print("cProfile of the simulation loop written to %s (view with python3 -m pstats)" % self.cprofile_file)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Solar and battery simulator')
+    parser.add_argument('config', help='yml configuration file name')
+    parser.add_argument('mode', help='Set the data mode which can be csv|api|profile')
+    parser.add_argument('--sweep', action='append', default=[], help='Sweep a CONFIG option over KEY=a,b,c or KEY=start:stop:step, can be repeated')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for a sweep, ensemble or portfolio (default all cores)')
+    parser.add_argument('--ensemble', type=int, default=None, help='Run a weather ensemble with this many members')
+    parser.add_argument('--portfolio', default=None, help='Project every household in a directory of consumption CSVs or a YAML manifest')
+    parser.add_argument('--optimize', action='store_true', help='Search the OPTIMIZE_* bounds for the sizes with the best OPTIMIZE_OBJECTIVE')
+    parser.add_argument('--timeline', action='store_true', help='Replay the consumption history in date order, then project on to YEARS from it')
+    parser.add_argument('--serve', action='store_true', help='Answer JSON quote requests, one per line on stdin or over HTTP with --port')
+    parser.add_argument('--port', type=int, default=None, help='With --serve answer POST requests on this localhost port')
+    parser.add_argument('--output', default=None, help='Results table file for a sweep, ensemble, portfolio, optimizer or timeline (default sweep.csv, ensemble.csv, portfolio.csv, optimize.csv or timeline.csv)')
+    parser.add_argument('--profile', nargs='?', const='profile.json', default=None, help='Time each stage of the run and write a JSON report (default profile.json)')
+    parser.add_argument('--cprofile', default=None, help='With --profile also write a cProfile dump of the simulation loop to this file')
+    for item in CONFIG:
+        parser.add_argument('--' + item, action='store', required=False, default=None)
+    args = parser.parse_args()
+    
+    # Read config and override defaults
+    with open(args.config, 'r') as fhan:
+        yconfig = yaml.safe_load(fhan)
+        for item in yconfig:
+            if item not in CONFIG:
+                print("ERROR: Bad configuration option in YML %s does not exist" % item)
+                return(1)
+            CONFIG[item] = yconfig[item]
+
+
+    # Command line overrides
+    for item in CONFIG:
+        if item in args:
+            value = getattr(args, item)
+            if value:
+                CONFIG[item] = config_value(item, value)
+
+    # Show configuration, the quote service keeps stdout for replies
+    print(CONFIG, file=sys.stderr if args.serve else sys.stdout)
+
+    # Stage timings, sweep workers are not profiled
+    profiler = None
+    if args.profile:
+        profiler = cl_profiler(args.cprofile)
+        profiler.install()
+
+    # Sweep many combinations or run a single simulation
+    try:
+        if args.sweep:
+            try:
+                sweeps = [parse_sweep(spec) for spec in args.sweep]
+            except ValueError as e:
+                print("ERROR: Bad sweep %s" % e)
+                return 1
+            sweep(load_data(args.mode), sweeps, args.output or 'sweep.csv', args.workers)
+        elif args.portfolio:
+            portfolio(args.portfolio, args.output or 'portfolio.csv', args.workers)
+        elif args.serve:
+            serve(load_data(args.mode, show=False), args.port)
+        elif args.ensemble:
+            ensemble(load_data(args.mode), args.ensemble, args.output or 'ensemble.csv', args.workers)
+        elif args.optimize:
+            optimize(load_data(args.mode), args.output or 'optimize.csv')
+        elif args.timeline:
+            timeline(load_data(args.mode), args.output or 'timeline.csv')
+        else:
+            simulate(args.mode)
+    except DataError as e:
+        print("ERROR: %s" % e)
+        return 1
+
+    if profiler:
+        profiler.uninstall()
+        profiler.report(args.profile, {'argv' : sys.argv, 'mode' : args.mode, 'sweep' : args.sweep})
+    return 0
+
+if __name__ == "__main__":
     exit(main())
\ No newline at end of file